@@ -4,10 +4,12 @@ from flask_sqlalchemy import SQLAlchemy
 import os
 from dotenv import load_dotenv
 
+from .routing import RoutingSession
+
 load_dotenv()
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 def create_app():
@@ -15,6 +17,12 @@ def create_app():
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "")
     app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///database.db")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # optional read replica for the reporting views, see routing.py
+    if os.getenv("REPLICA_DATABASE_URL"):
+        app.config["SQLALCHEMY_BINDS"] = {"replica": os.getenv("REPLICA_DATABASE_URL")}
+    app.config["REPLICA_STICKY_SECONDS"] = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+    # cohort snapshots built from the replica may predate the newest writes, 0 stops caching them
+    app.config["REPLICA_COHORT_TTL"] = float(os.getenv("REPLICA_COHORT_TTL", "5"))
     from datetime import timedelta
     #time la tdal remembered fik t7ot le badak ye
     #cookies hene feena ne3teber saved data jowa pc aw laptop
@@ -23,8 +31,54 @@ def create_app():
     app.config["REMEMBER_COOKIE_HTTPONLY"] = True
     app.config["REMEMBER_COOKIE_SAMESITE"] = os.getenv("REMEMBER_COOKIE_SAMESITE", "Lax")
     
+    app.config["CACHE_URL"] = os.getenv("CACHE_URL", "")
+    app.config["CACHE_MAX_ENTRIES"] = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+    app.config["CACHE_TTL"] = int(os.getenv("CACHE_TTL", "300"))
+    app.config["COHORT_TTL"] = int(os.getenv("COHORT_TTL", "60"))
+
+    # per-course risk cutoffs, e.g. {"12": [50, 50, 70, 65]}, used by student and instructor pages.
+    # the stored risk_level is only recomputed on writes, run `flask refresh-risk` after changing it
+    from .risk import parse_course_thresholds
+    app.config["RISK_COURSE_THRESHOLDS"] = parse_course_thresholds(os.getenv("RISK_COURSE_THRESHOLDS", ""))
+
+    # opt-in request profiling, see profiling.py
+    app.config["PROFILE_REQUESTS"] = os.getenv("PROFILE_REQUESTS", "false").lower() == "true"
+    app.config["PROFILE_DIR"] = os.getenv("PROFILE_DIR", "profiles")
+    app.config["PROFILE_SAMPLE_RATE"] = float(os.getenv("PROFILE_SAMPLE_RATE", "0.05"))
+    app.config["PROFILE_SLOW_MS"] = float(os.getenv("PROFILE_SLOW_MS", "500"))
+
+    # /metrics, see metrics.py; set METRICS_DIR when running several worker processes
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    app.config["METRICS_DIR"] = os.getenv("METRICS_DIR", "")
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN", "")
+    # /api/outbox answers only with this bearer token, unset keeps it closed
+    app.config["OUTBOX_TOKEN"] = os.getenv("OUTBOX_TOKEN", "")
+    app.config["METRICS_FLUSH_SECONDS"] = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+    # statements slower than SLOW_QUERY_MS, or filters that scan a whole table, go to SLOW_QUERY_LOG with their plan
+    app.config["SLOW_QUERY_MS"] = float(os.getenv("SLOW_QUERY_MS", "250"))
+    app.config["SLOW_QUERY_SCANS"] = os.getenv("SLOW_QUERY_SCANS", "true").lower() == "true"
+    app.config["SLOW_QUERY_ANALYZE"] = os.getenv("SLOW_QUERY_ANALYZE", "false").lower() == "true"
+    app.config["SLOW_QUERY_LOG"] = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")
+    app.config["SLOW_QUERY_LOG_BYTES"] = int(os.getenv("SLOW_QUERY_LOG_BYTES", "5000000"))
+
     db.init_app(app)
 
+    from .routing import init_routing
+    init_routing(app)
+
+    from .cache import init_cache
+    init_cache(app)
+
+    from .profiling import init_profiling
+    init_profiling(app)
+
+    from .metrics import init_metrics
+    init_metrics(app)
+
+    from .slowlog import init_slow_query_log
+    init_slow_query_log(app)
+
     from .models import User
     
     #hay btosta3mel la na3mel shi ktir mhm le howe login_required
@@ -46,11 +100,32 @@ def create_app():
     app.register_blueprint(auth, url_prefix="/")
     app.register_blueprint(student_views, url_prefix="/")
     app.register_blueprint(instructor, url_prefix="/")
+
+    from .commands import (
+        refresh_risk_command, verify_grades_command, rebuild_attendance_command, send_mail_command,
+        upgrade_db_command, check_indexes_command, slow_queries_command, init_db_command,
+        sync_replica_command, assign_course_command
+    )
+    app.cli.add_command(refresh_risk_command)
+    app.cli.add_command(verify_grades_command)
+    app.cli.add_command(rebuild_attendance_command)
+    app.cli.add_command(send_mail_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(check_indexes_command)
+    app.cli.add_command(slow_queries_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(sync_replica_command)
+    app.cli.add_command(assign_course_command)
     
-     #hon le na3mel local db eza ma ken mawjood
-    with app.app_context():
-        db.create_all()
-    
+    # the schema is created by `flask init-db`, so booting a worker never touches the database.
+    # with gunicorn --preload the workers are forked from this process and must not share its connections
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=lambda: _dispose_engine(app))
+
     return app
 
 
+def _dispose_engine(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
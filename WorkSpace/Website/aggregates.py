@@ -0,0 +1,130 @@
+from datetime import datetime
+
+from sqlalchemy import func, case, update
+
+from . import db
+from .models import Enrollment, Grade, Attendance
+from .risk import classify, course_thresholds
+
+
+TOLERANCE = 1e-6
+REPAIR_CHUNK = 500
+RISK_BATCH = 5000
+
+
+def grade_drift(tolerance: float = TOLERANCE):
+    sums = (
+        db.session.query(
+            Grade.enrollment_id.label("enrollment_id"),
+            func.sum(Grade.score * Grade.weight).label("weighted_score_sum"),
+            func.sum(Grade.weight).label("total_weight")
+        )
+        .group_by(Grade.enrollment_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(
+            Enrollment.id,
+            func.coalesce(Enrollment.weighted_score_sum, 0.0), func.coalesce(Enrollment.total_weight, 0.0),
+            func.coalesce(sums.c.weighted_score_sum, 0.0), func.coalesce(sums.c.total_weight, 0.0)
+        )
+        .outerjoin(sums, sums.c.enrollment_id == Enrollment.id)
+        .yield_per(REPAIR_CHUNK)
+    )
+
+    drift = []
+    for enrollment_id, stored_sum, stored_weight, actual_sum, actual_weight in rows:
+        if abs(stored_sum - actual_sum) > tolerance or abs(stored_weight - actual_weight) > tolerance:
+            drift.append({
+                "enrollment_id": enrollment_id,
+                "stored": (stored_sum, stored_weight),
+                "actual": (actual_sum, actual_weight)
+            })
+    return drift
+
+
+def repair_grades(drift):
+    for start in range(0, len(drift), REPAIR_CHUNK):
+        chunk = {d["enrollment_id"]: d["actual"] for d in drift[start:start + REPAIR_CHUNK]}
+        for enrollment in Enrollment.query.filter(Enrollment.id.in_(chunk)):
+            enrollment.weighted_score_sum, enrollment.total_weight = chunk[enrollment.id]
+            enrollment.derive_grade()
+            enrollment.refresh_risk()
+        db.session.commit()
+
+
+def rebuild_attendance(chunk_size: int = REPAIR_CHUNK):
+    table = course_thresholds()
+    rebuilt = 0
+    last_id = 0
+    while True:
+        enrollments = (
+            db.session.query(Enrollment.id, Enrollment.course_id, Enrollment.attendance_rate, Enrollment.current_grade)
+            .filter(Enrollment.id > last_id)
+            .order_by(Enrollment.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not enrollments:
+            return rebuilt
+        last_id = enrollments[-1][0]
+
+        counts = {
+            enrollment_id: (present, total)
+            for enrollment_id, present, total in (
+                db.session.query(
+                    Attendance.enrollment_id,
+                    func.count(case((Attendance.status == 'present', 1))),
+                    func.count(Attendance.id)
+                )
+                .filter(Attendance.enrollment_id.in_([e[0] for e in enrollments]))
+                .group_by(Attendance.enrollment_id)
+            )
+        }
+
+        ids, course_ids, rates, grades, values = [], [], [], [], []
+        for enrollment_id, course_id, rate, grade in enrollments:
+            present, total = counts.get(enrollment_id, (0, 0))
+            # enrollments without any records keep whatever rate they have
+            if total:
+                rate = (present / total) * 100
+            ids.append(enrollment_id)
+            course_ids.append(course_id)
+            rates.append(rate)
+            grades.append(grade)
+            values.append({"id": enrollment_id, "present_count": present, "total_count": total, "attendance_rate": rate})
+
+        now = datetime.utcnow()
+        for v, level in zip(values, classify(rates, grades, course_ids, table=table).tolist()):
+            v["risk_level"] = level
+            v["risk_updated_at"] = now
+
+        db.session.execute(update(Enrollment), values)
+        db.session.commit()
+        rebuilt += len(values)
+
+
+def refresh_risk_levels(only_missing: bool = False):
+    table = course_thresholds()
+    query = db.session.query(
+        Enrollment.id, Enrollment.course_id, Enrollment.attendance_rate, Enrollment.current_grade
+    ).order_by(Enrollment.id)
+    if only_missing:
+        query = query.filter(Enrollment.risk_level.is_(None))
+
+    updated = 0
+    last_id = 0
+    while True:
+        rows = query.filter(Enrollment.id > last_id).limit(RISK_BATCH).all()
+        if not rows:
+            return updated
+        ids, course_ids, att, grade = zip(*rows)
+        levels = classify(att, grade, course_ids, table=table)
+        now = datetime.utcnow()
+        db.session.execute(
+            update(Enrollment),
+            [{"id": i, "risk_level": int(l), "risk_updated_at": now} for i, l in zip(ids, levels.tolist())]
+        )
+        db.session.commit()
+        updated += len(ids)
+        last_id = ids[-1]
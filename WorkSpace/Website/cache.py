@@ -0,0 +1,175 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import current_app
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .routing import reading_replica
+
+
+# any object with get/set/incr works as a backend, so several gunicorn workers
+# can share one (e.g. redis) instead of each keeping its own copy. Without one the
+# entries stay per process but the version counters go to the database.
+
+class LocalBackend:
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # version counters live apart from the LRU so eviction can never roll one back
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    def __init__(self, url, prefix="dropout:"):
+        import redis  # only needed when CACHE_URL points at redis
+
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self.prefix + key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def counter(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return int(raw) if raw is not None else 0
+
+    def incr(self, key):
+        return self._redis.incr(self.prefix + key)
+
+
+class DatabaseCounters:
+    # LocalBackend's counters only exist in one process: a bump in the worker that handled a write
+    # would leave every other worker serving the old entry. Kept in the primary database instead,
+    # outside the request's session so replica routing and rollbacks don't touch them.
+    def counter(self, key):
+        from .models import CacheVersion
+        with db.engine.connect() as conn:
+            return conn.execute(select(CacheVersion.version).where(CacheVersion.scope == key)).scalar() or 0
+
+    def incr(self, key):
+        from .models import CacheVersion
+        for _ in range(2):
+            try:
+                with db.engine.begin() as conn:
+                    updated = conn.execute(
+                        update(CacheVersion).where(CacheVersion.scope == key)
+                        .values(version=CacheVersion.version + 1)
+                    ).rowcount
+                    if not updated:
+                        conn.execute(insert(CacheVersion).values(scope=key, version=1))
+                    return
+            except IntegrityError:
+                continue  # another worker inserted the row first, update it
+
+
+class VersionedCache:
+    # every entry is tied to a scope ("user:<id>", "cohort") whose version counter is bumped on writes
+    def __init__(self, backend, ttl=None, counters=None):
+        self.backend = backend
+        self.counters = counters or backend
+        self.ttl = ttl
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def version(self, scope):
+        return self.counters.counter(f"version:{scope}")
+
+    def bump(self, *scopes):
+        for scope in set(scopes):
+            self.counters.incr(f"version:{scope}")
+
+    def get_or_compute(self, scope, name, compute, *parts, ttl=None):
+        key = ":".join([name, scope, str(self.version(scope)), *map(str, parts)])
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits[name] += 1
+            return value
+        self.misses[name] += 1
+        value = compute()
+        self.backend.set(key, value, ttl=ttl or self.ttl)
+        return value
+
+    def stats(self):
+        stats = {}
+        for name in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[name], self.misses[name]
+            stats[name] = {"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses)}
+        return stats
+
+
+def init_cache(app):
+    url = app.config.get("CACHE_URL") or ""
+    counters = None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        backend = RedisBackend(url)
+    else:
+        backend = LocalBackend(max_entries=app.config.get("CACHE_MAX_ENTRIES", 2048))
+        counters = DatabaseCounters()
+    app.extensions["cache"] = VersionedCache(backend, ttl=app.config.get("CACHE_TTL"), counters=counters)
+
+
+def cache():
+    return current_app.extensions["cache"]
+
+
+def cached_for_user(user_id, name, compute, *parts):
+    return cache().get_or_compute(f"user:{user_id}", name, compute, *parts)
+
+
+def bump_users(*user_ids):
+    cache().bump(*(f"user:{user_id}" for user_id in user_ids))
+
+
+def cohort_snapshot(build, *parts):
+    # shared by every instructor view (parts tell instructors apart); dropped when enrollments,
+    # grades, attendance or course ownership change
+    ttl = current_app.config.get("COHORT_TTL")
+    if reading_replica():
+        # a lagging replica can miss the write that bumped the version, so whatever it built
+        # is only kept until replication has surely caught up
+        ttl = current_app.config.get("REPLICA_COHORT_TTL", 5)
+        if not ttl:
+            return build()
+    return cache().get_or_compute("cohort", "cohort", build, *parts, ttl=ttl)
+
+
+def bump_cohort():
+    cache().bump("cohort")
@@ -0,0 +1,144 @@
+import click
+from flask.cli import with_appcontext
+
+from .cache import bump_cohort
+from .aggregates import grade_drift, repair_grades, rebuild_attendance, refresh_risk_levels
+
+
+@click.command("refresh-risk", help="Recompute stored risk levels, run after changing RISK_COURSE_THRESHOLDS.")
+@click.option("--only-missing", is_flag=True, help="Only enrollments that were never classified.")
+@with_appcontext
+def refresh_risk_command(only_missing):
+    updated = refresh_risk_levels(only_missing)
+    bump_cohort()
+    click.echo(f"Refreshed risk for {updated} enrollments.")
+
+
+@click.command("verify-grades")
+@click.option("--repair", is_flag=True, help="Rewrite drifted enrollments from their Grade rows.")
+@with_appcontext
+def verify_grades_command(repair):
+    drift = grade_drift()
+    for d in drift[:20]:
+        click.echo(f"enrollment {d['enrollment_id']}: stored {d['stored']} != actual {d['actual']}")
+    if len(drift) > 20:
+        click.echo(f"... and {len(drift) - 20} more")
+    click.echo(f"{len(drift)} enrollments with drifted grade totals.")
+
+    if repair and drift:
+        repair_grades(drift)
+        bump_cohort()
+        click.echo(f"Repaired {len(drift)} enrollments.")
+
+
+@click.command("rebuild-attendance")
+@with_appcontext
+def rebuild_attendance_command():
+    rebuilt = rebuild_attendance()
+    bump_cohort()
+    click.echo(f"Rebuilt attendance counters for {rebuilt} enrollments.")
+
+
+@click.command("send-mail")
+@click.option("--once", is_flag=True, help="Send everything that is due and exit instead of polling.")
+@click.option("--batch-size", default=50, show_default=True)
+@click.option("--interval", default=2.0, show_default=True, help="Seconds to wait when the outbox is empty.")
+@with_appcontext
+def send_mail_command(once, batch_size, interval):
+    from .outbox import run_worker
+    run_worker(batch_size=batch_size, interval=interval, once=once, echo=click.echo)
+
+
+@click.command("assign-course")
+@click.argument("instructor_email")
+@click.argument("course_code")
+@with_appcontext
+def assign_course_command(instructor_email, course_code):
+    from . import db
+    from .models import User, Course
+    from .ownership import assign_course
+    instructor = User.query.filter_by(email=instructor_email.strip().lower(), role="instructor").first()
+    if not instructor:
+        raise click.ClickException(f"No instructor with email {instructor_email}.")
+    course = Course.query.filter_by(course_code=course_code.strip()).first()
+    if not course:
+        raise click.ClickException(f"No course with code {course_code}.")
+    if not assign_course(instructor.id, course.id):
+        click.echo(f"{instructor.email} already teaches {course.course_code}.")
+        return
+    db.session.commit()
+    bump_cohort()
+    click.echo(f"{instructor.email} now teaches {course.course_code}.")
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    from .migrations import init_db, current_version
+    applied = init_db()
+    for version, description in applied:
+        click.echo(f"applied {version}: {description}")
+    click.echo(f"Database ready, schema version {current_version()}.")
+
+
+@click.command("sync-replica")
+@with_appcontext
+def sync_replica_command():
+    from .routing import replica_configured, sync_sqlite_replica
+    if not replica_configured():
+        raise click.ClickException("REPLICA_DATABASE_URL is not set.")
+    try:
+        sync_sqlite_replica()
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    click.echo("Replica is now a copy of the primary.")
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    # same as init-db: migrations expect create_all to have run and search needs its index
+    from .migrations import init_db, current_version
+    applied = init_db()
+    for version, description in applied:
+        click.echo(f"applied {version}: {description}")
+    click.echo(f"Schema is at version {current_version()}.")
+
+
+@click.command("check-indexes")
+@click.option("--verbose", is_flag=True, help="Print the query plan of every check.")
+@with_appcontext
+def check_indexes_command(verbose):
+    from .migrations import check_indexes
+    failed = 0
+    for r in check_indexes():
+        failed += not r["ok"]
+        click.echo(f"{'OK  ' if r['ok'] else 'MISS'} {r['query']} -> {r['index']}")
+        if verbose or not r["ok"]:
+            click.echo("    " + r["plan"].replace("\n", "\n    "))
+    if failed:
+        raise click.ClickException(f"{failed} queries do not use their index.")
+
+
+@click.command("slow-queries")
+@click.option("--top", default=20, show_default=True)
+@click.option("--plans", is_flag=True, help="Print the captured plan of every statement.")
+@with_appcontext
+def slow_queries_command(top, plans):
+    from flask import current_app
+    from .slowlog import read_entries, summarize
+    groups = summarize(read_entries(current_app.config["SLOW_QUERY_LOG"]))
+    if not groups:
+        click.echo("No slow queries logged.")
+        return
+    for g in groups[:top]:
+        scans = f" FULL SCAN {','.join(sorted(g['full_scans']))}" if g["full_scans"] else ""
+        click.echo(
+            f"{g['fingerprint']} slow={g['slow']}/{g['count']} total={g['total_ms']:.0f}ms "
+            f"max={g['max_ms']:.0f}ms{scans} from {', '.join(sorted(g['origins'])) or '?'}"
+        )
+        click.echo(f"    {g['statement'][:300]}")
+        if plans or g["full_scans"]:
+            click.echo("    " + (g["plan"] or "no plan").replace("\n", "\n    "))
+    if len(groups) > top:
+        click.echo(f"... and {len(groups) - top} more statements")
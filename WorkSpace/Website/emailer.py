@@ -1,37 +1,42 @@
 import os
-import smtplib
-import ssl
-from email.message import EmailMessage
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-SMTP_HOST = os.getenv("SMTP_HOST")      
-SMTP_PORT = int(os.getenv("SMTP_PORT"))
-SMTP_USER = os.getenv("SMTP_USER")             
-SMTP_PASS = os.getenv("SMTP_PASS")             
-MAIL_FROM = os.getenv("MAIL_FROM", SMTP_USER)   
 
-APP_BASE_URL = os.getenv("APP_BASE_URL")
-
-
-def _require_env():
+# read when a mail is built or sent, not at import: the web app starts without any SMTP settings
+# and smtplib/ssl are only loaded by the process that actually delivers mail
+def smtp_config():
+    port = os.getenv("SMTP_PORT")
+    port = int(port) if port else None
+    user = os.getenv("SMTP_USER")
+    return {
+        "host": os.getenv("SMTP_HOST"),
+        "port": port,
+        "user": user,
+        "password": os.getenv("SMTP_PASS"),
+        "mail_from": os.getenv("MAIL_FROM", user),
+        "starttls": os.getenv("SMTP_STARTTLS", "true" if port == 587 else "false").lower() == "true",
+        "timeout": int(os.getenv("SMTP_TIMEOUT", "15")),
+    }
+
+
+def _require_env(config):
     missing = [k for k, v in {
-        "SMTP_HOST": SMTP_HOST,
-        "SMTP_PORT": SMTP_PORT,
-        "SMTP_USER": SMTP_USER,
-        "SMTP_PASS": SMTP_PASS,
-        "MAIL_FROM": MAIL_FROM
+        "SMTP_HOST": config["host"],
+        "SMTP_PORT": config["port"],
+        "MAIL_FROM": config["mail_from"]
     }.items() if not v]
     if missing:
         raise RuntimeError(f"Email not configured. Missing: {', '.join(missing)}")
 
 
-def _send_email(to_email: str, subject: str, html_body: str, text_body: str | None = None):
-    _require_env()
+def build_message(to_email: str, subject: str, html_body: str, text_body: str | None = None):
+    from email.message import EmailMessage
 
     msg = EmailMessage()
-    msg["From"] = MAIL_FROM
+    msg["From"] = smtp_config()["mail_from"]
     msg["To"] = to_email
     msg["Subject"] = subject
 
@@ -40,15 +45,79 @@ def _send_email(to_email: str, subject: str, html_body: str, text_body: str | No
     msg.set_content(text_body)
 
     msg.add_alternative(html_body, subtype="html")
-
-    if SMTP_PORT == 587:
-       
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=15) as server:
+    return msg
+
+
+class SMTPConnection:
+    # one connection kept open by the outbox worker and reused for every message,
+    # reopened when the server drops it, after it sat idle or after max_messages sends
+    def __init__(self, idle_timeout=60, max_messages=100):
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self._server = None
+        self._sent = 0
+        self._last_used = 0.0
+
+    def _open(self):
+        import smtplib
+        import ssl
+
+        config = smtp_config()
+        _require_env(config)
+        if config["port"] == 465:
+            server = smtplib.SMTP_SSL(config["host"], config["port"], timeout=config["timeout"], context=ssl.create_default_context())
+        else:
+            server = smtplib.SMTP(config["host"], config["port"], timeout=config["timeout"])
             server.ehlo()
-            server.starttls(context=ssl.create_default_context())
-            server.ehlo()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
+            if config["starttls"]:
+                server.starttls(context=ssl.create_default_context())
+                server.ehlo()
+        if config["user"] and config["password"]:
+            server.login(config["user"], config["password"])
+        self._server = server
+        self._sent = 0
+
+    def _stale(self):
+        return (
+            self._sent >= self.max_messages
+            or time.monotonic() - self._last_used > self.idle_timeout
+        )
+
+    def send(self, msg):
+        import smtplib
+
+        if self._server is not None and self._stale():
+            self.close()
+        if self._server is None:
+            self._open()
+
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # the server closed an idle connection on us, one fresh try
+            self.close()
+            self._open()
+            self._server.send_message(msg)
+
+        self._sent += 1
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is None:
+            return
+        import smtplib
+
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+
+def _send_email(to_email: str, subject: str, html_body: str, text_body: str | None = None):
+    # requests only queue the message, `flask send-mail` delivers it
+    from .outbox import enqueue
+    return enqueue(to_email, subject, html_body, text_body)
 
 
 def send_verify_otp(to_email: str, passcode: str, minutes_valid: int = 15):
@@ -69,7 +138,7 @@ def send_verify_otp(to_email: str, passcode: str, minutes_valid: int = 15):
 
 
 def send_reset_link(to_email: str, token: str):
-    link = f"{APP_BASE_URL}/reset-password/{token}"
+    link = f"{os.getenv('APP_BASE_URL')}/reset-password/{token}"
     subject = "Reset your password"
     html = f"""
     <div style="font-family:Arial,sans-serif;line-height:1.6">
@@ -101,10 +170,11 @@ def contact_us_function(email:str,message:str,name:str):
     </div>
      """
     text = f""
-    return _send_email(SMTP_USER,subject, html, text)
+    config = smtp_config()
+    return _send_email(config["user"] or config["mail_from"],subject, html, text)
 
 
-def send_student_invite(to_email: str, invite_link: str, instructor_name: str, course_name: str | None = None):
+def student_invite_email(invite_link: str, instructor_name: str, course_name: str | None = None):
     subject = "You were invited to join Dropout Analyzer"
     course_line = f"<p><b>Course:</b> {course_name}</p>" if course_name else ""
     html = f"""
@@ -127,5 +197,9 @@ def send_student_invite(to_email: str, invite_link: str, instructor_name: str, c
     </div>
     """
     text = f"You were invited by {instructor_name}. Accept here: {invite_link}"
-    return _send_email(to_email, subject, html, text)
+    return subject, html, text
+
+
+def send_student_invite(to_email: str, invite_link: str, instructor_name: str, course_name: str | None = None):
+    return _send_email(to_email, *student_invite_email(invite_link, instructor_name, course_name))
 
@@ -0,0 +1,42 @@
+import csv
+import importlib.util
+import io
+import os
+import tempfile
+
+
+FLUSH_ROWS = 500
+
+
+def csv_stream(header, rows):
+    # one small buffer reused for the whole export, flushed every FLUSH_ROWS rows
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for n, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if n % FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xlsx_available():
+    return importlib.util.find_spec("xlsxwriter") is not None
+
+
+def xlsx_file(header, rows, sheet="Export"):
+    import xlsxwriter  # optional, only needed for .xlsx exports
+
+    # constant_memory writes each row to disk as soon as the next one starts,
+    # a zip can't be streamed so the finished workbook is sent from a temp file
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    worksheet = workbook.add_worksheet(sheet)
+    worksheet.write_row(0, 0, header)
+    for n, row in enumerate(rows, start=1):
+        worksheet.write_row(n, 0, row)
+    workbook.close()
+    return path
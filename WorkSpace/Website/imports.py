@@ -0,0 +1,367 @@
+import csv
+import io
+import math
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import insert, delete
+
+from . import db
+from .cache import bump_users, bump_cohort
+from .models import User, Course, Enrollment, Grade, Attendance, StudentInvite, CourseInstructor, add_totals, GRADE_TOTALS, ATTENDANCE_COUNTS
+from .emailer import student_invite_email
+from .outbox import enqueue_many
+
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+
+
+GRADE_COLUMNS = ("email", "course_code", "exam_name", "score", "weight", "date")
+ATTENDANCE_COLUMNS = ("email", "course_code", "date", "status")
+ATTENDANCE_STATUSES = ("present", "absent")
+
+INVITE_COLUMNS = ("email",)
+MAX_BULK_INVITES = 2000
+INVITE_DAYS = 3
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def csv_chunks(file_storage, required, size: int = CHUNK_SIZE):
+    # reads the upload as it arrives instead of loading the whole sheet
+    stream = io.TextIOWrapper(file_storage.stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(stream)
+    reader.fieldnames = [(f or "").strip().lower() for f in (reader.fieldnames or [])]
+    missing = [c for c in required if c not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+    line = 1
+    while True:
+        chunk = list(islice(reader, size))
+        if not chunk:
+            return
+        yield line + 1, chunk
+        line += len(chunk)
+
+
+def parse_date(raw):
+    raw = (raw or "").strip()
+    return datetime.strptime(raw, '%Y-%m-%d').date() if raw else None
+
+
+def resolve_enrollments(pairs, instructor_id=None):
+    # pairs: {(email, course_code)} -> {(email, course_code): enrollment_id}
+    emails = {e for e, _ in pairs}
+    codes = {c for _, c in pairs}
+    if not emails or not codes:
+        return {}
+
+    query = (
+        db.session.query(User.email, Course.course_code, Enrollment.id)
+        .select_from(Enrollment)
+        .join(User, Enrollment.user_id == User.id)
+        .join(Course, Enrollment.course_id == Course.id)
+        .filter(User.email.in_(emails), Course.course_code.in_(codes))
+    )
+    if instructor_id is not None:
+        query = query.join(CourseInstructor, CourseInstructor.course_id == Course.id).filter(
+            CourseInstructor.instructor_id == instructor_id
+        )
+    rows = query.all()
+    return {((email or "").lower(), code): enrollment_id for email, code, enrollment_id in rows}
+
+
+class ImportSummary:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.errors = []
+        self.error_count = 0
+        self.touched = set()
+        self.unmarked = None
+
+    def error(self, where, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"{where}: {message}")
+
+    def as_dict(self):
+        result = {
+            "rows": self.rows,
+            "imported": self.imported,
+            "skipped": self.error_count,
+            "enrollments": len(self.touched),
+            "errors": self.errors
+        }
+        if self.unmarked is not None:
+            result["unmarked"] = self.unmarked
+        return result
+
+
+def import_grades(file_storage, instructor_id=None):
+    summary = ImportSummary()
+    # enrollment_id -> [sum(score * weight), sum(weight)] for everything inserted
+    deltas = defaultdict(lambda: [0.0, 0.0])
+
+    for first_line, chunk in csv_chunks(file_storage, GRADE_COLUMNS):
+        summary.rows += len(chunk)
+        keys = {((r.get("email") or "").strip().lower(), (r.get("course_code") or "").strip()) for r in chunk}
+        enrollments = resolve_enrollments(keys, instructor_id)
+
+        values = []
+        for line, r in enumerate(chunk, start=first_line):
+            key = ((r.get("email") or "").strip().lower(), (r.get("course_code") or "").strip())
+            enrollment_id = enrollments.get(key)
+            if not enrollment_id:
+                summary.error(f"line {line}", f"no enrollment for {key[0]} in {key[1]} among your courses")
+                continue
+            try:
+                score = float(r.get("score"))
+                weight = float(r.get("weight"))
+                date_recorded = parse_date(r.get("date"))
+            except (TypeError, ValueError):
+                summary.error(f"line {line}", "score, weight or date is not valid")
+                continue
+            # float() takes "nan" and "inf", either would poison the running totals for good
+            if not math.isfinite(score) or not math.isfinite(weight) or weight <= 0:
+                summary.error(f"line {line}", "score must be a number and weight a positive number")
+                continue
+
+            exam_name = (r.get("exam_name") or "").strip()
+            if not exam_name:
+                summary.error(f"line {line}", "exam_name is empty")
+                continue
+
+            values.append({
+                "enrollment_id": enrollment_id,
+                "exam_name": exam_name,
+                "score": score,
+                "weight": weight,
+                "date_recorded": date_recorded
+            })
+            deltas[enrollment_id][0] += score * weight
+            deltas[enrollment_id][1] += weight
+
+        if values:
+            db.session.execute(insert(Grade), values)
+            summary.imported += len(values)
+
+    summary.touched = set(deltas)
+    touched_users = _apply_deltas(deltas, GRADE_TOTALS, Enrollment.derive_grade)
+    db.session.commit()
+    bump_users(*touched_users)
+    bump_cohort()
+    return summary.as_dict()
+
+
+def _apply_deltas(deltas, columns, derive):
+    ids = list(deltas)
+    user_ids = set()
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        add_totals({i: deltas[i] for i in chunk}, columns)
+        for enrollment in Enrollment.query.filter(Enrollment.id.in_(chunk)).populate_existing():
+            derive(enrollment)
+            enrollment.refresh_risk()
+            user_ids.add(enrollment.user_id)
+        db.session.flush()
+    return user_ids
+
+
+def _status(raw):
+    status = str(raw or "").strip().lower()
+    return status if status in ATTENDANCE_STATUSES else None
+
+
+def _replace_marks(marks, deltas):
+    # marks: {(enrollment_id, day): status}. A mark replaces whatever was recorded for that
+    # student and day, so the same sheet can be submitted again; deltas gets old -> new
+    by_day = defaultdict(list)
+    for enrollment_id, day in marks:
+        by_day[day].append(enrollment_id)
+
+    recorded = defaultdict(list)
+    for day, ids in by_day.items():
+        for start in range(0, len(ids), CHUNK_SIZE):
+            for attendance_id, enrollment_id, status in (
+                db.session.query(Attendance.id, Attendance.enrollment_id, Attendance.status)
+                .filter(Attendance.enrollment_id.in_(ids[start:start + CHUNK_SIZE]), Attendance.date == day)
+            ):
+                recorded[(enrollment_id, day)].append((attendance_id, status))
+
+    values = []
+    replaced = []
+    for (enrollment_id, day), status in marks.items():
+        old = recorded.get((enrollment_id, day), [])
+        if [s for _, s in old] == [status]:
+            continue  # already marked like this
+        replaced += [attendance_id for attendance_id, _ in old]
+        values.append({"enrollment_id": enrollment_id, "date": day, "status": status})
+        deltas[enrollment_id][0] += (1 if status == 'present' else 0) - sum(1 for _, s in old if s == 'present')
+        deltas[enrollment_id][1] += 1 - len(old)
+
+    for start in range(0, len(replaced), CHUNK_SIZE):
+        db.session.execute(delete(Attendance).where(Attendance.id.in_(replaced[start:start + CHUNK_SIZE])))
+    if values:
+        db.session.execute(insert(Attendance), values)
+    return len(values)
+
+
+def record_roll_call(course_id, day, statuses):
+    # statuses: {student email or user id: "present"/"absent"} for one course on one day
+    summary = ImportSummary()
+    wanted = {str(k).strip().lower(): v for k, v in statuses.items()}
+    summary.rows = len(wanted)
+
+    roster = (
+        db.session.query(Enrollment.id, User.id, User.email)
+        .join(User, Enrollment.user_id == User.id)
+        .filter(Enrollment.course_id == course_id)
+        .all()
+    )
+
+    marks = {}
+    deltas = defaultdict(lambda: [0, 0])
+    seen = set()
+    for enrollment_id, user_id, email in roster:
+        key = str(user_id) if str(user_id) in wanted else (email or "").lower()
+        if key not in wanted:
+            continue
+        seen.add(key)
+        status = _status(wanted[key])
+        if not status:
+            summary.error(key, f"unknown status {wanted[key]!r}")
+            continue
+        marks[(enrollment_id, day)] = status
+
+    for key in wanted.keys() - seen:
+        summary.error(key, "not enrolled in this course")
+
+    summary.imported = _replace_marks(marks, deltas)
+
+    summary.touched = set(deltas)
+    summary.unmarked = len(roster) - len(seen)
+    touched_users = _apply_deltas(deltas, ATTENDANCE_COUNTS, Enrollment.derive_attendance)
+    db.session.commit()
+    bump_users(*touched_users)
+    bump_cohort()
+    return summary.as_dict()
+
+
+def import_attendance(file_storage, instructor_id=None):
+    summary = ImportSummary()
+    # enrollment_id -> [present, total] for everything inserted or replaced
+    deltas = defaultdict(lambda: [0, 0])
+
+    for first_line, chunk in csv_chunks(file_storage, ATTENDANCE_COLUMNS):
+        summary.rows += len(chunk)
+        keys = {((r.get("email") or "").strip().lower(), (r.get("course_code") or "").strip()) for r in chunk}
+        enrollments = resolve_enrollments(keys, instructor_id)
+
+        # a later row for the same student and day wins, like a later upload does
+        marks = {}
+        for line, r in enumerate(chunk, start=first_line):
+            key = ((r.get("email") or "").strip().lower(), (r.get("course_code") or "").strip())
+            enrollment_id = enrollments.get(key)
+            if not enrollment_id:
+                summary.error(f"line {line}", f"no enrollment for {key[0]} in {key[1]} among your courses")
+                continue
+            status = _status(r.get("status"))
+            try:
+                day = parse_date(r.get("date"))
+            except ValueError:
+                day = None
+            if not status or not day:
+                summary.error(f"line {line}", "status or date is not valid")
+                continue
+
+            marks[(enrollment_id, day)] = status
+
+        summary.imported += _replace_marks(marks, deltas)
+
+    summary.touched = set(deltas)
+    touched_users = _apply_deltas(deltas, ATTENDANCE_COUNTS, Enrollment.derive_attendance)
+    db.session.commit()
+    bump_users(*touched_users)
+    bump_cohort()
+    return summary.as_dict()
+
+
+def invite_addresses(pasted, file_storage=None):
+    # addresses pasted one per line (or comma separated), plus an optional CSV with an email column
+    found = [a for a in re.split(r"[\s,;]+", pasted or "") if a]
+    if file_storage is not None and file_storage.filename:
+        for _, chunk in csv_chunks(file_storage, INVITE_COLUMNS):
+            found.extend((row.get("email") or "").strip() for row in chunk)
+            if len(found) > MAX_BULK_INVITES:
+                break
+    if len(found) > MAX_BULK_INVITES:
+        raise ValueError(f"At most {MAX_BULK_INVITES} addresses per upload.")
+    return found
+
+
+def _accepted_emails(emails, course_id):
+    same_course = StudentInvite.course_id == course_id if course_id else StudentInvite.course_id.is_(None)
+    accepted = set()
+    emails = list(emails)
+    for start in range(0, len(emails), CHUNK_SIZE):
+        accepted.update(
+            e for (e,) in (
+                db.session.query(StudentInvite.student_email)
+                .filter(
+                    StudentInvite.student_email.in_(emails[start:start + CHUNK_SIZE]),
+                    StudentInvite.accepted.is_(True),
+                    same_course
+                )
+                .distinct()
+            )
+        )
+    return accepted
+
+
+def bulk_invite(instructor, addresses, course, link_for):
+    results = []
+    wanted = {}
+    for raw in addresses:
+        email = str(raw).strip().lower()
+        if not EMAIL_RE.match(email) or len(email) > StudentInvite.student_email.type.length:
+            results.append({"email": email, "status": "invalid"})
+        elif email in wanted:
+            results.append({"email": email, "status": "duplicate"})
+        else:
+            wanted[email] = {"email": email, "status": "invited"}
+            results.append(wanted[email])
+
+    course_id = course.id if course else None
+    for email in _accepted_emails(wanted, course_id):
+        wanted.pop(email)["status"] = "accepted"
+
+    instructor_name = f"{instructor.first_name} {instructor.last_name}".strip()
+    course_name = course.course_name if course else None
+    expires_at = datetime.utcnow() + timedelta(days=INVITE_DAYS)
+
+    invites = [
+        StudentInvite(
+            instructor_id=instructor.id,
+            student_email=email,
+            course_id=course_id,
+            token=StudentInvite.make_token(),
+            expires_at=expires_at
+        )
+        for email in wanted
+    ]
+    db.session.add_all(invites)
+
+    # invites and their emails go out in the same commit, the outbox worker sends them over one connection
+    enqueue_many(
+        (invite.student_email, *student_invite_email(link_for(invite.token), instructor_name, course_name))
+        for invite in invites
+    )
+
+    return {
+        "invited": len(invites),
+        "skipped": len(results) - len(invites),
+        "results": results
+    }
@@ -1,82 +1,285 @@
-from flask import Blueprint, render_template, request, url_for, redirect, flash, session
+from flask import Blueprint, current_app, render_template, request, url_for, redirect, flash, session, jsonify, Response, send_file, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
-
-from .models import User, Course, Enrollment, StudentInvite, CalendarEvent
+import base64
+import os
+import json
+import heapq
+from itertools import chain, islice
+from sqlalchemy import func, case, distinct, select, tuple_, union_all
+
+from .models import User, Course, Enrollment, StudentInvite, CalendarEvent, CourseInstructor
 from . import db
 from .emailer import send_student_invite
+from .outbox import outbox_status
+from .ownership import owned_courses, owns_course
+from .exports import csv_stream, xlsx_file, xlsx_available
+from .search import student_filter, search
+from .cache import bump_users, bump_cohort, cohort_snapshot, cache
+from .imports import import_grades, import_attendance, record_roll_call, parse_date, invite_addresses, bulk_invite, MAX_BULK_INVITES
+from .risk import classify, risk_level, course_thresholds, INSTRUCTOR_THRESHOLDS, HIGH, MED, RISK_CLASSES, RISK_LABELS
+from .routing import replica_reads
 
 instructor = Blueprint('instructor', __name__)
 
 
-def risk_bucket(attendance_rate: float, current_grade: float):
-    a = attendance_rate or 0.0
-    g = current_grade or 0.0
+OVERVIEW_SIZE = 12
+CLASSIFY_CHUNK = 2000
 
-    if a < 60 or g < 55:
-        return ("High", "high")
-    if a < 75 or g < 70:
-        return ("Medium", "med")
-    return ("Low", "low")
 
+def _owned(query, instructor_id, course_col=Enrollment.course_id):
+    # (course_id, instructor_id) is unique, so the join never duplicates rows
+    return query.join(CourseInstructor, CourseInstructor.course_id == course_col).filter(
+        CourseInstructor.instructor_id == instructor_id
+    )
 
-@instructor.route('/instructor')
-@login_required
-def instructor_log():
-    if current_user.role != "instructor":
-        return redirect(url_for("views.home"))
 
-    enrolls = (
-        db.session.query(Enrollment, User, Course)
+def _cohort_query(instructor_id):
+    return _owned(
+        db.session.query(
+            User.first_name, User.last_name, Course.id, Course.course_name,
+            Enrollment.attendance_rate, Enrollment.current_grade, Enrollment.risk_level
+        )
+        .select_from(Enrollment)
         .join(User, Enrollment.user_id == User.id)
-        .join(Course, Enrollment.course_id == Course.id)
-        .all()
+        .join(Course, Enrollment.course_id == Course.id),
+        instructor_id
     )
 
-    overview = []
-    total_students_set = set()
-    at_risk = 0
-    critical = 0
-
-    for en, u, c in enrolls:
-        total_students_set.add(u.id)
-
-        risk_label, risk_class = risk_bucket(en.attendance_rate, en.current_grade)
-        if risk_class == "med":
-            at_risk += 1
-        elif risk_class == "high":
-            critical += 1
-
-        overview.append({
-            "student_name": f"{u.first_name} {u.last_name}".strip(),
-            "course_name": c.course_name,
-            "attendance_rate": en.attendance_rate,
-            "current_grade": en.current_grade,
-            "risk_label": risk_label,
-            "risk_class": risk_class
-        })
-
-    risk_order = {"high": 0, "med": 1, "low": 2}
-    overview.sort(key=lambda r: (risk_order.get(r["risk_class"], 9), r["attendance_rate"], r["current_grade"]))
-    overview = overview[:12]
 
-    totals = {
-        "total_students": len(total_students_set),
+def _classify_stream(query):
+    table = course_thresholds()
+    rows = iter(query.yield_per(CLASSIFY_CHUNK))
+    while True:
+        chunk = list(islice(rows, CLASSIFY_CHUNK))
+        if not chunk:
+            return
+        first, last, course_ids, course_names, att, grade, _ = zip(*chunk)
+        levels = classify(att, grade, course_ids, table=table)
+        for i, level in enumerate(levels.tolist()):
+            yield (level, att[i] or 0.0, grade[i] or 0.0, first[i], last[i], course_names[i])
+
+
+def _top_at_risk(instructor_id, n):
+    ranked = (
+        _cohort_query(instructor_id)
+        .filter(Enrollment.risk_level.isnot(None))
+        .order_by(Enrollment.risk_level.asc(), Enrollment.attendance_rate.asc(), Enrollment.current_grade.asc())
+        .limit(n)
+        .all()
+    )
+    top = [
+        (level, att or 0.0, grade or 0.0, first, last, course_name)
+        for first, last, _, course_name, att, grade, level in ranked
+    ]
+
+    # rows written before risk_level existed are classified here, the heap only ever keeps n of them
+    if _owned(db.session.query(Enrollment.id), instructor_id).filter(Enrollment.risk_level.is_(None)).first():
+        unclassified = _cohort_query(instructor_id).filter(Enrollment.risk_level.is_(None))
+        top = heapq.nsmallest(n, chain(top, _classify_stream(unclassified)), key=lambda r: r[:3])
+
+    return top
+
+
+def _cohort_totals(instructor_id):
+    total_students, at_risk, critical = _owned(
+        db.session.query(
+            func.count(distinct(Enrollment.user_id)),
+            func.count(case((Enrollment.risk_level == MED, 1))),
+            func.count(case((Enrollment.risk_level == HIGH, 1)))
+        ).select_from(Enrollment),
+        instructor_id
+    ).one()
+    return {
+        "total_students": total_students,
         "at_risk": at_risk,
         "critical": critical
     }
 
+
+def _overview(instructor_id):
+    return [
+        {
+            "student_name": f"{first} {last}".strip(),
+            "course_name": course_name,
+            "attendance_rate": att,
+            "current_grade": grade,
+            "risk_label": RISK_LABELS[level],
+            "risk_class": RISK_CLASSES[level]
+        }
+        for level, att, grade, first, last, course_name in _top_at_risk(instructor_id, OVERVIEW_SIZE)
+    ]
+
+
+def _course_report_query(instructor_id):
+    total = func.count(Enrollment.id)
+    high = func.count(case((Enrollment.risk_level == HIGH, 1)))
+    high_pct = (100.0 * high) / total
+
+    return (
+        _owned(
+            db.session.query(Course.course_name, total, high, high_pct)
+            .join(Enrollment, Enrollment.course_id == Course.id),
+            instructor_id,
+            Course.id
+        )
+        .group_by(Course.id, Course.course_name)
+        .order_by(high_pct.desc(), high.desc(), Course.course_name.asc())
+    )
+
+
+def _course_report(instructor_id):
+    return [
+        {"course_name": course_name, "total": t, "high": h, "high_pct": float(pct or 0.0)}
+        for course_name, t, h, pct in _course_report_query(instructor_id)
+    ]
+
+
+def _critical_list(instructor_id):
+    return [
+        {"student_name": f"{first} {last}".strip(), "course_name": course_name}
+        for first, last, course_name in (
+            _owned(
+                db.session.query(User.first_name, User.last_name, Course.course_name)
+                .select_from(Enrollment)
+                .join(User, Enrollment.user_id == User.id)
+                .join(Course, Enrollment.course_id == Course.id),
+                instructor_id
+            )
+            .filter(Enrollment.risk_level == HIGH)
+            .order_by(Enrollment.id.asc())
+            .limit(8)
+            .all()
+        )
+    ]
+
+
+def _build_snapshot(instructor_id):
+    return {
+        "totals": _cohort_totals(instructor_id),
+        "overview": _overview(instructor_id),
+        "courses_report": _course_report(instructor_id),
+        "critical_list": _critical_list(instructor_id),
+        "courses": [
+            {"id": course_id, "course_name": course_name}
+            for course_id, course_name in (
+                db.session.query(Course.id, Course.course_name)
+                .filter(Course.id.in_(owned_courses(instructor_id)))
+                .order_by(Course.course_name.asc())
+            )
+        ],
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M")
+    }
+
+
+PAGE_SIZE = 50
+
+# keyset order for the roster: risk first, then name, id breaks ties. Within one course
+# ix_enrollment_roster serves it; every enrollment gets risk_level and sort_name when written
+ROSTER_ORDER = (Enrollment.risk_level, Enrollment.sort_name, Enrollment.id)
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def _decode_cursor(raw):
+    if not raw:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(raw.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != len(ROSTER_ORDER):
+        return None
+    # (risk_level, sort_name, id), anything else is a tampered link
+    risk, name, enrollment_id = values
+    if not (risk is None or _is_int(risk)) or not isinstance(name, str) or not _is_int(enrollment_id):
+        return None
+    return values
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _snapshot():
+    instructor_id = current_user.id
+    return cohort_snapshot(lambda: _build_snapshot(instructor_id), instructor_id)
+
+
+def _roster_rows(student_match, risk):
+    query = (
+        db.session.query(
+            User.first_name, User.last_name, User.email,
+            Course.id.label("course_id"), Course.course_name,
+            Enrollment.attendance_rate, Enrollment.current_grade, Enrollment.risk_level,
+            Enrollment.sort_name, Enrollment.id.label("enrollment_id")
+        )
+        .select_from(Enrollment)
+        .join(User, Enrollment.user_id == User.id)
+        .join(Course, Enrollment.course_id == Course.id)
+    )
+    if student_match is not None:
+        query = query.filter(student_match)
+    if risk:
+        level = RISK_CLASSES.index(risk) if risk in RISK_CLASSES else -1
+        query = query.filter(Enrollment.risk_level == level)
+    return query
+
+
+def _roster_query(instructor_id, q, risk):
+    return _owned(_roster_rows(student_filter(q) if q else None, risk), instructor_id)
+
+
+def _roster_page(instructor_id, q, risk, after, limit):
+    course_ids = [c for (c,) in db.session.execute(owned_courses(instructor_id))]
+    if not course_ids:
+        return []
+
+    # each course reads at most `limit` rows off its index and the outer query merges them,
+    # so a page costs the same however many students the courses have
+    student_match = student_filter(q) if q else None
+    parts = []
+    for course_id in course_ids:
+        part = _roster_rows(student_match, risk).filter(Enrollment.course_id == course_id)
+        if after:
+            part = part.filter(tuple_(*ROSTER_ORDER) > tuple_(*after))
+        parts.append(select(part.order_by(*ROSTER_ORDER).limit(limit).subquery()))
+    merged = union_all(*parts).subquery()
+    return db.session.execute(
+        select(merged)
+        .order_by(merged.c.risk_level, merged.c.sort_name, merged.c.enrollment_id)
+        .limit(limit)
+    ).all()
+
+
+def _level(stored, course_id, att, grade, table):
+    # rows written before risk_level existed are classified on the fly
+    return stored if stored is not None else risk_level(att, grade, table.get(course_id, INSTRUCTOR_THRESHOLDS))
+
+
+@instructor.route('/instructor')
+@login_required
+@replica_reads
+def instructor_log():
+    if current_user.role != "instructor":
+        return redirect(url_for("views.home"))
+
+    snapshot = _snapshot()
+
     return render_template(
         "instructorhomepage.html",
-        totals=totals,
-        overview=overview,
-        generated_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+        totals=snapshot["totals"],
+        overview=snapshot["overview"],
+        generated_at=snapshot["generated_at"],
         active_page="dashboard"
     )
 
 
 @instructor.route('/Instructor_students')
 @login_required
+@replica_reads
 def ins_students():
     if current_user.role != "instructor":
         return redirect(url_for("views.home"))
@@ -84,111 +287,62 @@ def ins_students():
     q = request.args.get("q", "").strip().lower()
     risk = request.args.get("risk", "").strip().lower()  # low/med/high
 
-    enrolls = (
-        db.session.query(Enrollment, User, Course)
-        .join(User, Enrollment.user_id == User.id)
-        .join(Course, Enrollment.course_id == Course.id)
-        .all()
-    )
-
-    rows = []
-    total_students_set = set()
-    at_risk = 0
-    critical = 0
-
-    for en, u, c in enrolls:
-        total_students_set.add(u.id)
-
-        risk_label, risk_class = risk_bucket(en.attendance_rate, en.current_grade)
-        if risk_class == "med":
-            at_risk += 1
-        elif risk_class == "high":
-            critical += 1
+    after = _decode_cursor(request.args.get("after", ""))
 
-        student_name = f"{u.first_name} {u.last_name}".strip()
-        email = u.email or ""
+    page = _roster_page(current_user.id, q, risk, after, PAGE_SIZE + 1)
 
-        if q:
-            hay = f"{student_name} {email}".lower()
-            if q not in hay:
-                continue
-        if risk and risk != risk_class:
-            continue
+    next_cursor = None
+    if len(page) > PAGE_SIZE:
+        page = page[:PAGE_SIZE]
+        next_cursor = _encode_cursor(page[-1][-len(ROSTER_ORDER):])
 
+    table = course_thresholds()
+    rows = []
+    for first, last, email, course_id, course_name, att, grade, stored, *_ in page:
+        level = _level(stored, course_id, att, grade, table)
         rows.append({
-            "student_name": student_name,
-            "email": email,
-            "course_name": c.course_name,
-            "attendance_rate": en.attendance_rate,
-            "current_grade": en.current_grade,
-            "risk_label": risk_label,
-            "risk_class": risk_class
+            "student_name": f"{first} {last}".strip(),
+            "email": email or "",
+            "course_name": course_name,
+            "attendance_rate": att,
+            "current_grade": grade,
+            "risk_label": RISK_LABELS[level],
+            "risk_class": RISK_CLASSES[level]
         })
 
-    risk_order = {"high": 0, "med": 1, "low": 2}
-    rows.sort(key=lambda r: (risk_order.get(r["risk_class"], 9), r["student_name"]))
-
-    totals = {
-        "total_students": len(total_students_set),
-        "at_risk": at_risk,
-        "critical": critical
-    }
-
-    courses = Course.query.order_by(Course.course_name.asc()).all()
+    snapshot = _snapshot()
 
     return render_template(
         "instructor_students.html",
         rows=rows,
-        totals=totals,
+        totals=snapshot["totals"],
         q=q,
         risk=risk,
-        courses=courses,
+        after=request.args.get("after", ""),
+        next_cursor=next_cursor,
+        courses=snapshot["courses"],
+        xlsx=xlsx_available(),
         active_page="students"
     )
 
 
 @instructor.route('/reports')
 @login_required
+@replica_reads
 def reports():
     if current_user.role != "instructor":
         return redirect(url_for("views.home"))
 
-    enrolls = (
-        db.session.query(Enrollment, User, Course)
-        .join(User, Enrollment.user_id == User.id)
-        .join(Course, Enrollment.course_id == Course.id)
-        .all()
-    )
-
-    by_course = {}
-    critical_list = []
-
-    for en, u, c in enrolls:
-        risk_label, risk_class = risk_bucket(en.attendance_rate, en.current_grade)
-
-        key = c.id
-        if key not in by_course:
-            by_course[key] = {"course_name": c.course_name, "total": 0, "high": 0}
-        by_course[key]["total"] += 1
-
-        if risk_class == "high":
-            by_course[key]["high"] += 1
-            critical_list.append({
-                "student_name": f"{u.first_name} {u.last_name}".strip(),
-                "course_name": c.course_name
-            })
-
-    courses_report = []
-    for _, v in by_course.items():
-        total = v["total"] or 1
-        high_pct = (v["high"] / total) * 100.0
-        courses_report.append({**v, "high_pct": high_pct})
-
-    courses_report.sort(key=lambda x: (-x["high_pct"], -x["high"], x["course_name"]))
-    critical_list = critical_list[:8]
+    snapshot = _snapshot()
 
     events = (
         CalendarEvent.query
+        .filter(
+            (CalendarEvent.user_id == current_user.id)
+            | CalendarEvent.user_id.in_(
+                select(Enrollment.user_id).where(Enrollment.course_id.in_(owned_courses(current_user.id)))
+            )
+        )
         .order_by(CalendarEvent.event_date.asc())
         .limit(6)
         .all()
@@ -196,14 +350,174 @@ def reports():
 
     return render_template(
         "reports.html",
-        courses=courses_report,
-        critical_list=critical_list,
+        courses=snapshot["courses_report"],
+        critical_list=snapshot["critical_list"],
         events=events,
-        generated_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+        generated_at=snapshot["generated_at"],
+        xlsx=xlsx_available(),
         active_page="reports"
     )
 
 
+EXPORT_CHUNK = 1000
+ROSTER_HEADER = ("student_name", "email", "course_name", "attendance_rate", "current_grade", "risk")
+REPORT_HEADER = ("course_name", "enrollments", "high_risk", "high_risk_pct")
+
+
+def _roster_export_rows(instructor_id, q, risk):
+    table = course_thresholds()
+    # yield_per streams from a server side cursor, only EXPORT_CHUNK rows are held at a time
+    query = _roster_query(instructor_id, q, risk).order_by(*ROSTER_ORDER).yield_per(EXPORT_CHUNK)
+    for first, last, email, course_id, course_name, att, grade, stored, *_ in query:
+        level = _level(stored, course_id, att, grade, table)
+        yield (
+            f"{first} {last}".strip(), email or "", course_name,
+            round(att or 0.0, 1), round(grade or 0.0, 1), RISK_LABELS[level]
+        )
+
+
+def _report_export_rows(instructor_id):
+    for course_name, total, high, pct in _course_report_query(instructor_id).yield_per(EXPORT_CHUNK):
+        yield (course_name, total, high, round(float(pct or 0.0), 1))
+
+
+def _export(name, header, rows):
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d')}"
+
+    if request.args.get("format", "csv").lower() == "xlsx":
+        if not xlsx_available():
+            return jsonify({"error": "XLSX export needs the xlsxwriter package."}), 501
+        path = xlsx_file(header, rows, sheet=name.title())
+        response = send_file(
+            path,
+            as_attachment=True,
+            download_name=f"{filename}.xlsx",
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+        response.call_on_close(lambda: os.remove(path))
+        return response
+
+    return Response(
+        stream_with_context(csv_stream(header, rows)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+    )
+
+
+@instructor.route('/export/roster')
+@login_required
+def export_roster():
+    if current_user.role != "instructor":
+        return redirect(url_for("views.home"))
+
+    q = request.args.get("q", "").strip().lower()
+    risk = request.args.get("risk", "").strip().lower()
+    return _export("roster", ROSTER_HEADER, _roster_export_rows(current_user.id, q, risk))
+
+
+@instructor.route('/export/report')
+@login_required
+def export_report():
+    if current_user.role != "instructor":
+        return redirect(url_for("views.home"))
+    return _export("report", REPORT_HEADER, _report_export_rows(current_user.id))
+
+
+@instructor.route('/api/search')
+@login_required
+def search_api():
+    if current_user.role != "instructor":
+        return jsonify({"error": "Unauthorized"}), 403
+
+    q = request.args.get("q", "")
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    return jsonify(search(q, limit=limit, instructor_id=current_user.id))
+
+
+def _csv_import(importer, what):
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Please choose a CSV file to import.", "error")
+        return redirect(url_for("instructor.ins_students"))
+
+    try:
+        summary = importer(upload, current_user.id)
+    except (ValueError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        flash(f"Import failed: {e}", "error")
+        return redirect(url_for("instructor.ins_students"))
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(summary)
+
+    flash(
+        f"Imported {summary['imported']} of {summary['rows']} {what} "
+        f"across {summary['enrollments']} enrollments.", "success"
+    )
+    for message in summary["errors"][:5]:
+        flash(message, "error")
+    return redirect(url_for("instructor.ins_students"))
+
+
+@instructor.route('/import-grades', methods=['POST'])
+@login_required
+def import_grades_csv():
+    if current_user.role != "instructor":
+        return redirect(url_for("views.home"))
+    return _csv_import(import_grades, "grades")
+
+
+@instructor.route('/import-attendance', methods=['POST'])
+@login_required
+def import_attendance_csv():
+    if current_user.role != "instructor":
+        return redirect(url_for("views.home"))
+    return _csv_import(import_attendance, "attendance records")
+
+
+@instructor.route('/api/roll-call', methods=['POST'])
+@login_required
+def roll_call():
+    if current_user.role != "instructor":
+        return jsonify({"error": "Unauthorized"}), 403
+
+    data = request.get_json(silent=True) or {}
+    course = db.session.get(Course, data.get("course_id")) if str(data.get("course_id", "")).isdigit() else None
+    statuses = data.get("statuses")
+    try:
+        day = parse_date(str(data.get("date") or ""))
+    except ValueError:
+        day = None
+
+    if not course:
+        return jsonify({"error": "Unknown course."}), 400
+    if not owns_course(current_user.id, course.id):
+        return jsonify({"error": "You do not teach this course."}), 403
+    if not day:
+        return jsonify({"error": "date must be YYYY-MM-DD."}), 400
+    if not isinstance(statuses, dict) or not statuses:
+        return jsonify({"error": "statuses must map students to present/absent."}), 400
+
+    return jsonify(record_roll_call(course.id, day, statuses))
+
+
+@instructor.route('/api/cache-stats')
+@login_required
+def cache_stats():
+    if current_user.role != "instructor":
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(cache().stats())
+
+
+@instructor.route('/api/outbox')
+def outbox_api():
+    # operators only: anyone can sign up as an instructor, so the role is not enough
+    token = current_app.config.get("OUTBOX_TOKEN")
+    if not token or request.headers.get("Authorization") != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(outbox_status())
+
+
 @instructor.route('/instructor_settings')
 @login_required
 def settings():
@@ -242,6 +556,8 @@ def invite_student():
     if not student_email:
         flash("Please enter a student email.", "error")
         return redirect(url_for("instructor.ins_students"))
+    if course_id and not (course_id.isdigit() and owns_course(current_user.id, int(course_id))):
+        return "You do not teach this course.", 403
 
     token = StudentInvite.make_token()
     invite = StudentInvite(
@@ -274,6 +590,59 @@ def invite_student():
     return redirect(url_for("instructor.ins_students"))
 
 
+@instructor.route('/invite-students', methods=['POST'])
+@login_required
+def invite_students_bulk():
+    if current_user.role != "instructor":
+        return jsonify({"error": "Unauthorized"}), 403
+
+    payload = request.get_json(silent=True)
+    wants_json = payload is not None or request.accept_mimetypes.best == "application/json"
+
+    try:
+        if payload is not None:
+            if not isinstance(payload, dict):
+                raise ValueError("Expected a JSON object.")
+            addresses = payload.get("emails") or []
+            if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+                raise ValueError("emails must be a list of addresses.")
+            if len(addresses) > MAX_BULK_INVITES:
+                raise ValueError(f"At most {MAX_BULK_INVITES} addresses per request.")
+            course_id = payload.get("course_id")
+        else:
+            addresses = invite_addresses(request.form.get("student_emails"), request.files.get("file"))
+            course_id = (request.form.get("course_id") or "").strip()
+        course = db.session.get(Course, int(course_id)) if course_id else None
+        if course_id and not course:
+            raise ValueError("Course not found.")
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        if wants_json:
+            return jsonify({"error": str(e)}), 400
+        flash(f"Invites failed: {e}", "error")
+        return redirect(url_for("instructor.ins_students"))
+
+    if course and not owns_course(current_user.id, course.id):
+        if wants_json:
+            return jsonify({"error": "You do not teach this course."}), 403
+        return "You do not teach this course.", 403
+
+    summary = bulk_invite(
+        current_user,
+        addresses,
+        course,
+        lambda token: url_for('instructor.accept_invite', token=token, _external=True)
+    )
+
+    if wants_json:
+        return jsonify(summary)
+
+    flash(f"Invited {summary['invited']} students, skipped {summary['skipped']}.", "success")
+    skipped = [r for r in summary["results"] if r["status"] != "invited"]
+    for r in skipped[:5]:
+        flash(f"{r['email'] or '(blank)'}: {r['status']}", "error")
+    return redirect(url_for("instructor.ins_students"))
+
+
 @instructor.route('/accept-invite/<token>')
 def accept_invite(token):
     invite = StudentInvite.query.filter_by(token=token).first()
@@ -330,11 +699,15 @@ def accept_invite(token):
     if course:
         existing = Enrollment.query.filter_by(user_id=current_user.id, course_id=course.id).first()
         if not existing:
-            db.session.add(Enrollment(user_id=current_user.id, course_id=course.id))
+            enrollment = Enrollment(user_id=current_user.id, course_id=course.id)
+            enrollment.refresh_risk()
+            db.session.add(enrollment)
 
     invite.accepted = True
     invite.accepted_at = datetime.utcnow()
     db.session.commit()
+    bump_users(current_user.id)
+    bump_cohort()
 
     return render_template(
         "invite_result.html",
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import contains_eager
+
+from . import db
+from .models import Course, Enrollment, CalendarEvent, User, Grade, Attendance, CourseInstructor
+
+
+STREAM_CHUNK = 500
+
+
+# every loader here is a single query no matter how many courses the student has
+
+def load_enrollments(user_id):
+    return (
+        Enrollment.query
+        .join(Course, Enrollment.course_id == Course.id)
+        .options(contains_eager(Enrollment.course))
+        .filter(Enrollment.user_id == user_id)
+        .order_by(Enrollment.id.asc())
+        .all()
+    )
+
+
+def load_instructor_names(user_id):
+    rows = (
+        db.session.query(Enrollment.course_id, User.first_name, User.last_name)
+        .join(CourseInstructor, CourseInstructor.course_id == Enrollment.course_id)
+        .join(User, CourseInstructor.instructor_id == User.id)
+        .filter(Enrollment.user_id == user_id)
+        .order_by(CourseInstructor.id.asc())
+        .all()
+    )
+
+    names = {}
+    for course_id, first, last in rows:
+        name = f"{first} {last}".strip()
+        names[course_id] = f"{names[course_id]}, {name}" if course_id in names else name
+    return names
+
+
+def load_upcoming_grades(user_id, start, end):
+    return (
+        db.session.query(Grade.exam_name, Grade.date_recorded, Course.course_name)
+        .join(Enrollment, Grade.enrollment_id == Enrollment.id)
+        .join(Course, Enrollment.course_id == Course.id)
+        .filter(
+            Enrollment.user_id == user_id,
+            Grade.date_recorded >= start,
+            Grade.date_recorded < end
+        )
+        .all()
+    )
+
+
+def load_upcoming_events(user_id, start, end):
+    return (
+        CalendarEvent.query
+        .filter(
+            CalendarEvent.user_id == user_id,
+            CalendarEvent.event_date >= datetime.combine(start, datetime.min.time()),
+            CalendarEvent.event_date < datetime.combine(end, datetime.min.time())
+        )
+        .all()
+    )
+
+
+def load_dashboard(user, today, days=7):
+    end = today + timedelta(days=days)
+    return {
+        "enrollments": load_enrollments(user.id),
+        "instructors": load_instructor_names(user.id),
+        "grades": load_upcoming_grades(user.id, today, end),
+        "events": load_upcoming_events(user.id, today, end)
+    }
+
+
+def iter_calendar_items(user_id, start, end):
+    # start inclusive, end exclusive; rows are streamed instead of loaded up front
+    manual = (
+        db.session.query(CalendarEvent.id, CalendarEvent.title, CalendarEvent.event_date, CalendarEvent.event_type)
+        .filter(
+            CalendarEvent.user_id == user_id,
+            CalendarEvent.event_date >= datetime.combine(start, datetime.min.time()),
+            CalendarEvent.event_date < datetime.combine(end, datetime.min.time())
+        )
+        .yield_per(STREAM_CHUNK)
+    )
+    for event_id, title, event_date, event_type in manual:
+        yield {
+            "id": event_id,
+            "title": title,
+            "date": event_date.strftime('%Y-%m-%d'),
+            "type": event_type,
+            "is_manual": True
+        }
+
+    grades = (
+        db.session.query(Grade.exam_name, Grade.date_recorded, Course.course_name)
+        .join(Enrollment, Grade.enrollment_id == Enrollment.id)
+        .join(Course, Enrollment.course_id == Course.id)
+        .filter(Enrollment.user_id == user_id, Grade.date_recorded >= start, Grade.date_recorded < end)
+        .yield_per(STREAM_CHUNK)
+    )
+    for exam_name, date_recorded, course_name in grades:
+        yield {
+            "id": None,
+            "title": f"{course_name or 'Course'} - {exam_name}",
+            "date": date_recorded.strftime('%Y-%m-%d'),
+            "type": "Exam",
+            "is_manual": False
+        }
+
+    attendance = (
+        db.session.query(Attendance.status, Attendance.date, Course.course_name)
+        .join(Enrollment, Attendance.enrollment_id == Enrollment.id)
+        .join(Course, Enrollment.course_id == Course.id)
+        .filter(Enrollment.user_id == user_id, Attendance.date >= start, Attendance.date < end)
+        .yield_per(STREAM_CHUNK)
+    )
+    for status, day, course_name in attendance:
+        yield {
+            "id": None,
+            "title": f"{course_name or 'Course'} - {status}",
+            "date": day.strftime('%Y-%m-%d'),
+            "type": "Attendance",
+            "is_manual": False
+        }
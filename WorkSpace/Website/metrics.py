@@ -0,0 +1,250 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request, current_app, Response, abort
+from sqlalchemy import event
+
+
+# every process keeps its own registry. With METRICS_DIR set (gunicorn, the outbox worker)
+# each one also writes a snapshot file there, and /metrics adds all of them up.
+# Empty the directory when the service starts so counters from old deploys don't linger.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    "http_requests_total": ("counter", "Requests handled, by route and status."),
+    "http_request_duration_seconds": ("histogram", "Time to build the response, by route."),
+    "db_pool_checkout_seconds": ("histogram", "Time spent waiting for a pooled database connection."),
+    "db_pool_checked_out": ("gauge", "Database connections currently checked out."),
+    "email_enqueued_total": ("counter", "Emails added to the outbox."),
+    "email_sent_total": ("counter", "Emails delivered by the outbox worker."),
+    "email_send_failures_total": ("counter", "Failed delivery attempts, kind is retry or failed."),
+    "email_send_duration_seconds": ("histogram", "Time to hand one email to the SMTP server."),
+    "cache_hits_total": ("counter", "Cache lookups answered from the cache."),
+    "cache_misses_total": ("counter", "Cache lookups that had to compute the value."),
+    "cache_hit_ratio": ("gauge", "Hits over lookups since the processes started."),
+}
+
+# gauges describe the present, a snapshot nobody refreshed for this long is a dead process
+STALE_SECONDS = 120
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[(name, _key(labels))] += value
+
+    def set_counter(self, name, value, **labels):
+        # for totals some other object already counts (cache stats)
+        with self._lock:
+            self.counters[(name, _key(labels))] = value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            hist[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "written_at": time.time(),
+                "counters": [[n, dict(l), v] for (n, l), v in self.counters.items()],
+                "gauges": [[n, dict(l), v] for (n, l), v in self.gauges.items()],
+                "histograms": [[n, dict(l), list(h[0]), h[1], h[2]] for (n, l), h in self.histograms.items()],
+            }
+
+
+registry = Registry()
+
+
+def merge(snapshots, now=None):
+    now = now or time.time()
+    counters = defaultdict(float)
+    gauges = defaultdict(float)
+    histograms = {}
+    for snap in snapshots:
+        for name, labels, value in snap["counters"]:
+            counters[(name, _key(labels))] += value
+        if now - snap["written_at"] <= STALE_SECONDS:
+            for name, labels, value in snap["gauges"]:
+                gauges[(name, _key(labels))] += value
+        for name, labels, buckets, total, count in snap["histograms"]:
+            hist = histograms.setdefault((name, _key(labels)), [[0] * len(buckets), 0.0, 0])
+            hist[0] = [a + b for a, b in zip(hist[0], buckets)]
+            hist[1] += total
+            hist[2] += count
+
+    # the ratio only makes sense over every process together, so it is derived after merging
+    for (name, labels), hits in list(counters.items()):
+        if name == "cache_hits_total":
+            misses = counters.get(("cache_misses_total", labels), 0)
+            if hits + misses:
+                gauges[("cache_hit_ratio", labels)] = hits / (hits + misses)
+
+    return counters, gauges, histograms
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render(counters, gauges, histograms):
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        if kind == "histogram":
+            series = sorted((k, v) for k, v in histograms.items() if k[0] == name)
+        else:
+            source = counters if kind == "counter" else gauges
+            series = sorted((k, v) for k, v in source.items() if k[0] == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (_, labels), value in series:
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+                continue
+            buckets, total, count = value
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def _collect():
+    # values other objects already keep are copied in when a snapshot is taken
+    cache = current_app.extensions.get("cache")
+    if cache is not None:
+        for name, s in cache.stats().items():
+            registry.set_counter("cache_hits_total", s["hits"], cache=name)
+            registry.set_counter("cache_misses_total", s["misses"], cache=name)
+
+    from . import db
+    for key, engine in db.engines.items():
+        if hasattr(engine.pool, "checkedout"):
+            registry.set_gauge("db_pool_checked_out", engine.pool.checkedout(), bind=key or "primary")
+
+
+def flush():
+    directory = current_app.config.get("METRICS_DIR")
+    if not directory:
+        return
+    _collect()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _snapshots():
+    directory = current_app.config.get("METRICS_DIR")
+    if not directory:
+        _collect()
+        return [registry.snapshot()]
+    flush()
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # a process is rewriting it right now
+    return snapshots
+
+
+def _time_pool_checkout(pool, bind):
+    # there is no "before checkout" pool event, so the pool's own getter is timed instead
+    if getattr(pool, "_metrics_timed", False) or not hasattr(pool, "_do_get"):
+        return
+    do_get = pool._do_get
+
+    def timed_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            registry.observe("db_pool_checkout_seconds", time.perf_counter() - started, bind=bind)
+
+    pool._do_get = timed_get
+    pool._metrics_timed = True
+
+
+def metrics_view():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        abort(401)
+    body = render(*merge(_snapshots()))
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+def init_metrics(app):
+    if not app.config.get("METRICS_ENABLED"):
+        return
+
+    from . import db
+    with app.app_context():
+        for key, engine in db.engines.items():
+            _time_pool_checkout(engine.pool, key or "primary")
+            # dispose() (forked --preload workers, sync-replica) swaps in a new, untimed pool
+            event.listen(engine, "engine_disposed", lambda e, bind=key or "primary": _time_pool_checkout(e.pool, bind))
+
+    flush_every = app.config.get("METRICS_FLUSH_SECONDS", 5)
+    last_flush = [0.0]
+
+    @app.before_request
+    def start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return response
+        # unmatched urls share one label so random paths can't grow the registry
+        endpoint = request.endpoint or "unmatched"
+        registry.observe("http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        registry.inc("http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+
+        now = time.monotonic()
+        if now - last_flush[0] >= flush_every:
+            last_flush[0] = now
+            flush()
+        return response
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,244 @@
+from contextlib import contextmanager
+from datetime import datetime, date
+
+from sqlalchemy import inspect, select, insert, update, func, text
+
+from . import db
+from .models import User, Enrollment, Grade, Attendance, CalendarEvent, StudentInvite, CourseInstructor, EmailOutbox
+
+
+# create_all only creates missing tables, so anything added to an existing table goes through here.
+# every migration has to be safe to run twice: data fixes commit as they go, and a crash before
+# the version row is written means the migration runs again on the next upgrade.
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(200), nullable=False),
+    db.Column("applied_at", db.DateTime, nullable=False)
+)
+
+MIGRATIONS = []
+LOCK_KEY = 72120018
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def _add_missing_columns(table):
+    existing = {c["name"] for c in inspect(db.session.connection()).get_columns(table.name)}
+    preparer = db.engine.dialect.identifier_preparer
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl_type = column.type.compile(dialect=db.engine.dialect)
+        db.session.execute(text(
+            f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(column.name)} {ddl_type}"
+        ))
+        added.append(column.name)
+    return added
+
+
+def _create_indexes(*models):
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(bind=db.session.connection(), checkfirst=True)
+
+
+@migration(1, "enrollment running totals and stored risk level")
+def _enrollment_totals():
+    from .aggregates import grade_drift, repair_grades, rebuild_attendance, refresh_risk_levels
+
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name != "schema_version":
+            added += _add_missing_columns(table)
+    db.session.commit()
+
+    if added:
+        repair_grades(grade_drift())
+        rebuild_attendance()
+        refresh_risk_levels(only_missing=True)
+
+
+@migration(2, "hot path indexes")
+def _hot_path_indexes():
+    _create_indexes(Grade, Attendance, CalendarEvent, StudentInvite, CourseInstructor, EmailOutbox)
+    for index in Enrollment.__table__.indexes:
+        if not index.unique:
+            index.create(bind=db.session.connection(), checkfirst=True)
+    db.session.commit()
+
+
+@migration(3, "one enrollment per student and course")
+def _unique_enrollment():
+    from .aggregates import grade_drift, repair_grades, rebuild_attendance
+
+    duplicates = (
+        db.session.query(Enrollment.user_id, Enrollment.course_id, func.min(Enrollment.id))
+        .group_by(Enrollment.user_id, Enrollment.course_id)
+        .having(func.count(Enrollment.id) > 1)
+        .all()
+    )
+    # grades and attendance of the extra rows move to the oldest one before the extras go
+    for user_id, course_id, keep in duplicates:
+        extra = [
+            i for (i,) in db.session.query(Enrollment.id).filter(
+                Enrollment.user_id == user_id, Enrollment.course_id == course_id, Enrollment.id != keep
+            )
+        ]
+        db.session.execute(update(Grade).where(Grade.enrollment_id.in_(extra)).values(enrollment_id=keep))
+        db.session.execute(update(Attendance).where(Attendance.enrollment_id.in_(extra)).values(enrollment_id=keep))
+        db.session.query(Enrollment).filter(Enrollment.id.in_(extra)).delete(synchronize_session=False)
+    db.session.commit()
+
+    if duplicates:
+        repair_grades(grade_drift())
+        rebuild_attendance()
+
+    _create_indexes(Enrollment)
+    db.session.commit()
+
+
+@migration(4, "course ownership from existing invites")
+def _course_ownership():
+    from .ownership import backfill_course_instructors
+    backfill_course_instructors()
+
+
+@migration(5, "enrollment sort name for the roster")
+def _enrollment_sort_name():
+    from .models import sort_name
+
+    _add_missing_columns(Enrollment.__table__)
+    db.session.commit()
+    names = (
+        db.session.query(Enrollment.id, User.first_name, User.last_name)
+        .join(User, Enrollment.user_id == User.id)
+        .filter(Enrollment.sort_name.is_(None))
+    )
+    rows = [{"id": i, "sort_name": sort_name(first, last)} for i, first, last in names]
+    for start in range(0, len(rows), 5000):
+        db.session.execute(update(Enrollment), rows[start:start + 5000])
+    _create_indexes(Enrollment)
+    db.session.commit()
+
+
+@migration(6, "drop enrollment indexes the roster index covers")
+def _drop_redundant_enrollment_indexes():
+    # every instructor query is scoped to owned courses, (course_id, risk_level) is the head of
+    # ix_enrollment_roster and the planner picked the wrong one of two near duplicates
+    for name in ("ix_enrollment_risk_course", "ix_enrollment_course_risk"):
+        db.session.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    db.session.commit()
+
+
+@contextmanager
+def _lock():
+    # postgres: only one process migrates at a time, the others wait and then see the new version.
+    # the migrations commit as they go, so the lock is held on a connection of its own for the
+    # whole run instead of in the session's transaction
+    if db.engine.dialect.name != "postgresql":
+        yield
+        return
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            conn.commit()
+
+
+def current_version():
+    schema_version.create(bind=db.engine, checkfirst=True)
+    return db.session.query(func.max(schema_version.c.version)).scalar() or 0
+
+
+def upgrade():
+    applied = []
+    with _lock():
+        for version, description, fn in sorted(MIGRATIONS):
+            if version <= current_version():
+                db.session.commit()
+                continue
+            fn()
+            db.session.execute(insert(schema_version).values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+            db.session.commit()
+            applied.append((version, description))
+    return applied
+
+
+def init_db():
+    # everything a fresh or older database needs before the app can serve it; run once per deploy
+    # (`flask init-db`), not from create_app in every worker
+    from .search import install_search_index
+
+    db.create_all()
+    applied = upgrade()
+    install_search_index()
+    return applied
+
+
+# (what the query is for, index it should use, the query)
+def _index_checks():
+    now = datetime.utcnow()
+    today = date.today()
+    return [
+        ("student enrollments", "uq_enrollment_user_course",
+         select(Enrollment.id, Enrollment.course_id).where(Enrollment.user_id == 1)),
+        ("roster page of a course", "ix_enrollment_roster",
+         select(Enrollment.id).where(Enrollment.course_id == 1)
+         .order_by(Enrollment.risk_level, Enrollment.sort_name, Enrollment.id).limit(51)),
+        ("course roster by risk", "ix_enrollment_roster",
+         select(Enrollment.id).where(Enrollment.course_id == 1, Enrollment.risk_level == 0)),
+        ("grades of an enrollment", "ix_grade_enrollment_date",
+         select(Grade.id).where(Grade.enrollment_id == 1, Grade.date_recorded >= today)),
+        ("attendance of an enrollment", "ix_attendance_enrollment_date",
+         select(Attendance.id).where(Attendance.enrollment_id == 1, Attendance.date >= today)),
+        ("calendar window", "ix_calendar_event_user_date",
+         select(CalendarEvent.id).where(CalendarEvent.user_id == 1, CalendarEvent.event_date >= now)),
+        ("accepted invites for an email", "ix_student_invite_email_accepted",
+         select(StudentInvite.id).where(StudentInvite.student_email == "a@b.c", StudentInvite.accepted.is_(True))),
+        ("courses of an instructor", "ix_course_instructor_instructor",
+         select(CourseInstructor.course_id).where(CourseInstructor.instructor_id == 1)),
+        ("due outbox messages", "ix_email_outbox_status_next",
+         select(EmailOutbox.id).where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)),
+    ]
+
+
+def explain(stmt):
+    dialect = db.engine.dialect
+    compiled = stmt.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[k] for k in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    conn = db.session.connection()
+    if dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+        plan = "\n".join(str(r[-1]) for r in rows)
+    else:
+        # small tables would be scanned anyway, this asks whether an index *can* serve the query
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        rows = conn.exec_driver_sql(f"EXPLAIN {compiled}", params).all()
+        plan = "\n".join(str(r[0]) for r in rows)
+    db.session.rollback()
+    return plan
+
+
+def check_indexes():
+    results = []
+    for name, index, stmt in _index_checks():
+        plan = explain(stmt)
+        results.append({"query": name, "index": index, "ok": index in plan, "plan": plan})
+    return results
@@ -1,8 +1,10 @@
 from flask_login import UserMixin
 from . import db
+from .risk import risk_level, course_thresholds, INSTRUCTOR_THRESHOLDS
 from datetime import datetime
 import secrets
 from datetime import datetime, timedelta
+from sqlalchemy import event, select, update, inspect, bindparam, func
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -39,9 +41,117 @@ class Enrollment(db.Model):
     attendance_rate = db.Column(db.Float, default=100.0)
     current_grade = db.Column(db.Float, default=0.0)
 
+    # running sums so current_grade never needs a rescan of the grades
+    weighted_score_sum = db.Column(db.Float, default=0.0)
+    total_weight = db.Column(db.Float, default=0.0)
+
+    present_count = db.Column(db.Integer, default=0)
+    total_count = db.Column(db.Integer, default=0)
+
+    # 0 high / 1 med / 2 low (see risk.py), sorted and filtered on by the instructor pages
+    risk_level = db.Column(db.Integer, nullable=True)
+    risk_updated_at = db.Column(db.DateTime, nullable=True)
+
+    # copy of the student's name so the roster can be ordered from an index without joining user
+    sort_name = db.Column(db.String(61), nullable=True)
+
     grades = db.relationship('Grade', backref='enrollment', lazy=True, cascade="all, delete-orphan")
     attendance_records = db.relationship('Attendance', backref='enrollment', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index("ix_enrollment_risk_rank", "risk_level", "attendance_rate", "current_grade"),
+        db.Index("ix_enrollment_roster", "course_id", "risk_level", "sort_name", "id"),
+        # one enrollment per student per course, also the index for "my courses"
+        db.Index("uq_enrollment_user_course", "user_id", "course_id", unique=True),
+    )
+
+    def apply_grade(self, score: float, weight: float, sign: int = 1):
+        self.add_grade_totals(sign * score * weight, sign * weight)
+
+    def add_grade_totals(self, weighted_score: float, weight: float):
+        self._add_totals(GRADE_TOTALS, (weighted_score, weight))
+        self.derive_grade()
+
+    def derive_grade(self):
+        # removing the last grade can leave float noise behind instead of a clean 0
+        if (self.total_weight or 0.0) <= 1e-9:
+            self.weighted_score_sum = 0.0
+            self.total_weight = 0.0
+            self.current_grade = 0.0
+        else:
+            self.current_grade = self.weighted_score_sum / self.total_weight
+
+    def apply_attendance(self, status: str, sign: int = 1):
+        self.add_attendance_counts(sign if status == 'present' else 0, sign)
+
+    def add_attendance_counts(self, present: int, total: int):
+        self._add_totals(ATTENDANCE_COUNTS, (present, total))
+        self.derive_attendance()
+
+    def _add_totals(self, columns, deltas):
+        if self.id is None:
+            for column, delta in zip(columns, deltas):
+                setattr(self, column, (getattr(self, column) or 0) + delta)
+            return
+        # the row is updated first so a concurrent writer waits for us, then the derived columns
+        # are worked out from what is really stored
+        add_totals({self.id: deltas}, columns)
+        db.session.refresh(self, list(columns))
+
+    def derive_attendance(self):
+        if (self.total_count or 0) > 0:
+            self.attendance_rate = (self.present_count / self.total_count) * 100
+        else:
+            self.present_count = 0
+            self.total_count = 0
+            self.attendance_rate = 0
+
+    def refresh_risk(self):
+        thresholds = course_thresholds().get(self.course_id, INSTRUCTOR_THRESHOLDS)
+        self.risk_level = risk_level(self.attendance_rate, self.current_grade, thresholds)
+        self.risk_updated_at = datetime.utcnow()
+
+
+GRADE_TOTALS = ("weighted_score_sum", "total_weight")
+ATTENDANCE_COUNTS = ("present_count", "total_count")
+
+
+def add_totals(deltas, columns):
+    # {enrollment_id: (delta, ...)} added in SQL, a read-modify-write in python would let two
+    # requests grading the same student overwrite each other
+    table = Enrollment.__table__
+    stmt = update(table).where(table.c.id == bindparam("_id")).values({
+        c: func.coalesce(table.c[c], 0) + bindparam(f"_{c}") for c in columns
+    })
+    db.session.execute(stmt, [
+        {"_id": enrollment_id, **{f"_{c}": d for c, d in zip(columns, values)}}
+        for enrollment_id, values in deltas.items()
+    ])
+
+
+def sort_name(first_name, last_name):
+    return f"{first_name or ''} {last_name or ''}".strip().lower()
+
+
+@event.listens_for(Enrollment, "before_insert")
+def _enrollment_sort_name(mapper, connection, target):
+    if target.sort_name is None:
+        first, last = connection.execute(
+            select(User.first_name, User.last_name).where(User.id == target.user_id)
+        ).one()
+        target.sort_name = sort_name(first, last)
+
+
+@event.listens_for(User, "after_update")
+def _rename_enrollments(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.first_name.history.has_changes() or attrs.last_name.history.has_changes():
+        connection.execute(
+            update(Enrollment)
+            .where(Enrollment.user_id == target.id)
+            .values(sort_name=sort_name(target.first_name, target.last_name))
+        )
+
 
 class Grade(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,12 +161,20 @@ class Grade(db.Model):
     weight = db.Column(db.Float, nullable=False)     
     date_recorded = db.Column(db.Date, nullable=True)
 
+    __table_args__ = (
+        db.Index("ix_grade_enrollment_date", "enrollment_id", "date_recorded"),
+    )
+
 class Attendance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     enrollment_id = db.Column(db.Integer, db.ForeignKey('enrollment.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
     status = db.Column(db.String(20), nullable=False) 
 
+    __table_args__ = (
+        db.Index("ix_attendance_enrollment_date", "enrollment_id", "date"),
+    )
+
 class CalendarEvent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -64,6 +182,22 @@ class CalendarEvent(db.Model):
     event_date = db.Column(db.DateTime, nullable=False)
     event_type = db.Column(db.String(50))
 
+    __table_args__ = (
+        db.Index("ix_calendar_event_user_date", "user_id", "event_date"),
+    )
+
+class CourseInstructor(db.Model):
+    # which instructor teaches which course; every instructor page is scoped through this
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    instructor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("course_id", "instructor_id", name="uq_course_instructor"),
+        db.Index("ix_course_instructor_instructor", "instructor_id", "course_id"),
+    )
+
 class StudentInvite(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
@@ -80,6 +214,37 @@ class StudentInvite(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        db.Index("ix_student_invite_email_accepted", "student_email", "accepted"),
+    )
+
     @staticmethod
     def make_token():
-        return secrets.token_urlsafe(32)
\ No newline at end of file
+        return secrets.token_urlsafe(32)
+
+class EmailOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+
+    to_email = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html_body = db.Column(db.Text, nullable=False)
+    text_body = db.Column(db.Text, nullable=True)
+
+    # pending -> sending -> sent, or back to pending with a later next_attempt_at, or failed
+    status = db.Column(db.String(20), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(500), nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+
+class CacheVersion(db.Model):
+    # version counters of the cache scopes, shared by every worker when entries are cached in-process
+    scope = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
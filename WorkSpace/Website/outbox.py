@@ -0,0 +1,182 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, func
+
+from . import db
+from .models import EmailOutbox
+from .emailer import SMTPConnection, build_message
+from .metrics import registry, flush
+
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30      # seconds before the first retry, doubled on every failure
+BACKOFF_MAX = 3600
+# a claimed message goes back to the queue if its worker dies before finishing it
+LEASE_SECONDS = 300
+
+
+def enqueue(to_email, subject, html_body, text_body=None):
+    msg = EmailOutbox(to_email=to_email, subject=subject, html_body=html_body, text_body=text_body)
+    db.session.add(msg)
+    db.session.commit()
+    registry.inc("email_enqueued_total")
+    return msg
+
+
+def enqueue_many(messages):
+    # messages are (to_email, subject, html_body, text_body); one commit for the whole batch
+    rows = [
+        EmailOutbox(to_email=to, subject=subject, html_body=html, text_body=text)
+        for to, subject, html, text in messages
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    registry.inc("email_enqueued_total", len(rows))
+    return rows
+
+
+def _due(now):
+    return (
+        EmailOutbox.status.in_(("pending", "sending")),
+        EmailOutbox.next_attempt_at <= now
+    )
+
+
+def claim_batch(size):
+    now = datetime.utcnow()
+    ids = [
+        i for (i,) in (
+            db.session.query(EmailOutbox.id)
+            .filter(*_due(now))
+            .order_by(EmailOutbox.next_attempt_at.asc(), EmailOutbox.id.asc())
+            .limit(size)
+        )
+    ]
+
+    # the conditional update only matches for one worker, so several can drain the same table
+    claimed = []
+    for message_id in ids:
+        result = db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id == message_id, *_due(now))
+            .values(status="sending", next_attempt_at=now + timedelta(seconds=LEASE_SECONDS))
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            claimed.append(message_id)
+    db.session.commit()
+
+    if not claimed:
+        return []
+    return EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id.asc()).all()
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 10)
+
+
+def _permanent(exc):
+    import smtplib
+
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return True
+    code = getattr(exc, "smtp_code", None)
+    return isinstance(code, int) and 500 <= code < 600
+
+
+def _record_failure(msg, exc):
+    msg.attempts += 1
+    msg.last_error = f"{type(exc).__name__}: {exc}"[:500]
+    if _permanent(exc) or msg.attempts >= MAX_ATTEMPTS:
+        msg.status = "failed"
+    else:
+        msg.status = "pending"
+        msg.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff(msg.attempts))
+
+
+def drain(conn, batch_size=50):
+    import smtplib  # only the mail worker gets here, the web app never loads it
+
+    counts = {"sent": 0, "retry": 0, "failed": 0}
+
+    for msg in claim_batch(batch_size):
+        started = time.perf_counter()
+        try:
+            conn.send(build_message(msg.to_email, msg.subject, msg.html_body, msg.text_body))
+        except (smtplib.SMTPException, OSError) as exc:
+            if not isinstance(exc, smtplib.SMTPRecipientsRefused):
+                conn.close()
+            _record_failure(msg, exc)
+            kind = "failed" if msg.status == "failed" else "retry"
+            counts[kind] += 1
+            registry.inc("email_send_failures_total", kind=kind)
+        else:
+            msg.status = "sent"
+            msg.attempts += 1
+            msg.last_error = None
+            msg.sent_at = datetime.utcnow()
+            counts["sent"] += 1
+            registry.inc("email_sent_total")
+        registry.observe("email_send_duration_seconds", time.perf_counter() - started)
+        # commit per message so a crash never sends something twice
+        db.session.commit()
+
+    return counts
+
+
+def run_worker(batch_size=50, interval=2.0, once=False, echo=print):
+    conn = SMTPConnection()
+    try:
+        while True:
+            counts = drain(conn, batch_size)
+            handled = sum(counts.values())
+            # the worker is its own process, its numbers reach /metrics through METRICS_DIR
+            flush()
+            if handled:
+                echo(f"sent={counts['sent']} retry={counts['retry']} failed={counts['failed']}")
+            if once and not handled:
+                return
+            # a full batch means more is probably waiting, otherwise wait for new mail
+            if not once and handled < batch_size:
+                time.sleep(interval)
+    finally:
+        conn.close()
+
+
+def outbox_status(recent=10):
+    counts = dict(
+        db.session.query(EmailOutbox.status, func.count(EmailOutbox.id))
+        .group_by(EmailOutbox.status)
+        .all()
+    )
+    oldest = (
+        db.session.query(func.min(EmailOutbox.created_at))
+        .filter(EmailOutbox.status.in_(("pending", "sending")))
+        .scalar()
+    )
+    failures = (
+        EmailOutbox.query
+        .filter(EmailOutbox.last_error.isnot(None))
+        .order_by(EmailOutbox.id.desc())
+        .limit(recent)
+        .all()
+    )
+
+    return {
+        "counts": {s: counts.get(s, 0) for s in ("pending", "sending", "sent", "failed")},
+        "oldest_pending_seconds": (datetime.utcnow() - oldest).total_seconds() if oldest else 0,
+        "recent_failures": [
+            {
+                "id": m.id,
+                "subject": m.subject,
+                "status": m.status,
+                "attempts": m.attempts,
+                "last_error": m.last_error,
+                "next_attempt_at": m.next_attempt_at.isoformat()
+            }
+            for m in failures
+        ]
+    }
@@ -0,0 +1,37 @@
+from sqlalchemy import select, insert, func
+
+from . import db
+from .models import CourseInstructor, StudentInvite
+
+
+def owned_courses(instructor_id):
+    return select(CourseInstructor.course_id).where(CourseInstructor.instructor_id == instructor_id)
+
+
+def owns_course(instructor_id, course_id):
+    return db.session.query(CourseInstructor.id).filter_by(
+        instructor_id=instructor_id, course_id=course_id
+    ).first() is not None
+
+
+def assign_course(instructor_id, course_id):
+    # only from `flask assign-course`, inviting into a course never claims it
+    if not course_id or owns_course(instructor_id, course_id):
+        return False
+    db.session.add(CourseInstructor(instructor_id=instructor_id, course_id=course_id))
+    return True
+
+
+def backfill_course_instructors():
+    # before this table existed ownership was only implied by invites
+    if db.session.query(CourseInstructor.id).first():
+        return
+    db.session.execute(
+        insert(CourseInstructor).from_select(
+            ["course_id", "instructor_id", "created_at"],
+            select(StudentInvite.course_id, StudentInvite.instructor_id, func.min(StudentInvite.created_at))
+            .where(StudentInvite.course_id.isnot(None))
+            .group_by(StudentInvite.course_id, StudentInvite.instructor_id)
+        )
+    )
+    db.session.commit()
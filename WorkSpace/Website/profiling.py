@@ -0,0 +1,147 @@
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import time
+from datetime import datetime
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# nothing in here is hooked up unless PROFILE_REQUESTS is on, so a disabled profiler costs nothing
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.email_ms = 0.0
+        self.email_count = 0
+        self.profiler = None
+        self._templates = []
+
+
+def _current():
+    return g.get("_profile") if has_request_context() else None
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    profile = _current()
+    if profile is not None:
+        conn.info.setdefault("_profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    profile = _current()
+    started = conn.info.get("_profile_started")
+    if profile is not None and started:
+        profile.sql_count += 1
+        profile.sql_ms += (time.perf_counter() - started.pop()) * 1000
+
+
+def _before_template(app, template, context, **extra):
+    profile = _current()
+    if profile is not None:
+        profile._templates.append(time.perf_counter())
+
+
+def _after_template(app, template, context, **extra):
+    profile = _current()
+    if profile is not None and profile._templates:
+        profile.template_ms += (time.perf_counter() - profile._templates.pop()) * 1000
+
+
+def _timed_email(send):
+    if getattr(send, "_profiled", False):
+        return send
+
+    @functools.wraps(send)
+    def wrapper(*args, **kwargs):
+        profile = _current()
+        if profile is None:
+            return send(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return send(*args, **kwargs)
+        finally:
+            profile.email_count += 1
+            profile.email_ms += (time.perf_counter() - started) * 1000
+
+    wrapper._profiled = True
+    return wrapper
+
+
+def _dump(app, profile, record):
+    directory = app.config["PROFILE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+
+    if profile.profiler is not None and record["wall_ms"] >= app.config["PROFILE_SLOW_MS"]:
+        name = f"{datetime.utcnow():%Y%m%d-%H%M%S}-{record['endpoint'] or 'none'}-{os.getpid()}"
+        path = os.path.join(directory, name)
+        profile.profiler.dump_stats(path + ".prof")
+        with open(path + ".txt", "w") as f:
+            pstats.Stats(profile.profiler, stream=f).sort_stats("cumulative").print_stats(40)
+        record["profile"] = name + ".prof"
+
+    with open(os.path.join(directory, "requests.jsonl"), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def init_profiling(app):
+    if not app.config.get("PROFILE_REQUESTS"):
+        return
+
+    from . import emailer
+    emailer._send_email = _timed_email(emailer._send_email)
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor):
+        event.listen(Engine, "before_cursor_execute", _before_cursor)
+        event.listen(Engine, "after_cursor_execute", _after_cursor)
+    before_render_template.connect(_before_template, app)
+    template_rendered.connect(_after_template, app)
+
+    sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+
+    @app.before_request
+    def start_profile():
+        profile = RequestProfile()
+        # cProfile is too slow to leave on, a sample of requests get it and only slow ones are kept
+        if sample_rate and random.random() < sample_rate:
+            profile.profiler = cProfile.Profile()
+            try:
+                profile.profiler.enable()
+            except ValueError:
+                profile.profiler = None  # another profiler is already running on this thread
+        g._profile = profile
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop("_profile", None)
+        if profile is None:
+            return response
+        if profile.profiler is not None:
+            profile.profiler.disable()
+
+        record = {
+            "at": datetime.utcnow().isoformat(timespec="milliseconds"),
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "blueprint": request.blueprint,
+            "status": response.status_code,
+            # streamed bodies are still being produced at this point, so this is time to first byte
+            "wall_ms": round((time.perf_counter() - profile.started) * 1000, 2),
+            "sql_count": profile.sql_count,
+            "sql_ms": round(profile.sql_ms, 2),
+            "template_ms": round(profile.template_ms, 2),
+            "email_count": profile.email_count,
+            "email_ms": round(profile.email_ms, 2),
+        }
+        _dump(app, profile, record)
+        return response
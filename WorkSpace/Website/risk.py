@@ -0,0 +1,81 @@
+import json
+from collections import namedtuple
+
+import numpy as np
+from flask import current_app
+
+
+HIGH, MED, LOW = 0, 1, 2
+RISK_CLASSES = ("high", "med", "low")
+RISK_LABELS = ("High", "Medium", "Low")
+
+Thresholds = namedtuple("Thresholds", ["high_attendance", "high_grade", "med_attendance", "med_grade"])
+
+# instructor pages and student pages have always used different cutoffs, both are kept
+INSTRUCTOR_THRESHOLDS = Thresholds(60, 55, 75, 70)
+STUDENT_THRESHOLDS = Thresholds(70, 65, 85, 75)
+
+
+def parse_course_thresholds(raw):
+    # JSON from the environment: {"<course_id>": [high_attendance, high_grade, med_attendance, med_grade]}
+    table = json.loads(raw) if raw else {}
+    if not isinstance(table, dict):
+        raise ValueError("RISK_COURSE_THRESHOLDS must be a JSON object keyed by course id")
+    parsed = {}
+    for k, v in table.items():
+        if not isinstance(v, list) or len(v) != 4 or not all(isinstance(x, (int, float)) for x in v):
+            raise ValueError(f"RISK_COURSE_THRESHOLDS[{k!r}] must be a list of 4 numbers")
+        parsed[int(k)] = Thresholds(*v)
+    return parsed
+
+
+def course_thresholds():
+    # {course_id: (high_attendance, high_grade, med_attendance, med_grade)}
+    table = current_app.config.get("RISK_COURSE_THRESHOLDS") or {}
+    return {int(k): Thresholds(*v) for k, v in table.items()}
+
+
+def _column(values):
+    return np.nan_to_num(np.asarray(values, dtype=float), nan=0.0)
+
+
+def _threshold_columns(course_ids, default, table):
+    keys, inverse = np.unique(np.asarray(course_ids), return_inverse=True)
+    per_course = np.array([table.get(k, default) for k in keys.tolist()], dtype=float).reshape(-1, 4)
+    return per_course[inverse.reshape(-1)].T
+
+
+def classify(attendance, grades, course_ids=None, thresholds=INSTRUCTOR_THRESHOLDS, table=None):
+    a = _column(attendance)
+    g = _column(grades)
+
+    if table and course_ids is not None and len(a):
+        high_a, high_g, med_a, med_g = _threshold_columns(course_ids, thresholds, table)
+    else:
+        high_a, high_g, med_a, med_g = thresholds
+
+    levels = np.full(a.shape, LOW, dtype=np.int8)
+    levels[(a < med_a) | (g < med_g)] = MED
+    levels[(a < high_a) | (g < high_g)] = HIGH
+    return levels
+
+
+def risk_counts(levels):
+    c = np.bincount(np.asarray(levels, dtype=np.intp), minlength=3)
+    return {"high": int(c[HIGH]), "med": int(c[MED]), "low": int(c[LOW])}
+
+
+def risk_level(attendance_rate: float, current_grade: float, thresholds=INSTRUCTOR_THRESHOLDS):
+    a = attendance_rate or 0.0
+    g = current_grade or 0.0
+
+    if a < thresholds.high_attendance or g < thresholds.high_grade:
+        return HIGH
+    if a < thresholds.med_attendance or g < thresholds.med_grade:
+        return MED
+    return LOW
+
+
+def risk_bucket(attendance_rate: float, current_grade: float, thresholds=INSTRUCTOR_THRESHOLDS):
+    level = risk_level(attendance_rate, current_grade, thresholds)
+    return (RISK_LABELS[level], RISK_CLASSES[level])
@@ -0,0 +1,80 @@
+import functools
+import time
+
+from flask import g, request, session, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+
+REPLICA = "replica"
+
+
+class RoutingSession(Session):
+    # reads of views marked with @replica_reads go to the replica bind, everything else
+    # (and anything after the request wrote) goes to the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and reading_replica():
+            return self._db.engines[REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def reading_replica():
+    return has_request_context() and g.get("_db_route") == REPLICA and not g.get("_db_wrote")
+
+
+def _mark_write(*args):
+    if has_request_context():
+        g._db_wrote = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _check_statement(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        _mark_write()
+
+
+event.listen(RoutingSession, "after_flush", _mark_write)
+
+
+def replica_configured():
+    return REPLICA in (current_app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+def _sticky():
+    # the user wrote something a moment ago, the replica may not have it yet
+    return session.get("_primary_until", 0) > time.time()
+
+
+def replica_reads(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ("GET", "HEAD") and replica_configured() and not _sticky():
+            g._db_route = REPLICA
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_routing(app):
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get("_db_wrote") and app.config.get("REPLICA_STICKY_SECONDS"):
+            session["_primary_until"] = time.time() + app.config["REPLICA_STICKY_SECONDS"]
+        return response
+
+
+def sync_sqlite_replica():
+    # local stand-in for replication: copy the primary sqlite file over the replica
+    import sqlite3
+
+    from . import db
+    primary, replica = db.engine, db.engines[REPLICA]
+    if primary.dialect.name != "sqlite" or replica.dialect.name != "sqlite":
+        raise RuntimeError("only sqlite replicas can be synced here, use real replication for postgres")
+    replica.dispose()
+    source = sqlite3.connect(primary.url.database)
+    target = sqlite3.connect(replica.url.database)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
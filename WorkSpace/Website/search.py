@@ -0,0 +1,165 @@
+from sqlalchemy import func, text, table, column, literal_column, select, Integer
+
+from . import db
+from .models import User, Course, Enrollment, CourseInstructor
+
+
+# sqlite: fts5 tables with the trigram tokenizer so "contains" searches stay substring searches,
+# kept in sync by triggers on user/course. rowid of each fts row is the user/course id.
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search
+       USING fts5(name, email, tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON user BEGIN
+         INSERT INTO user_search(rowid, name, email)
+         VALUES (new.id, coalesce(new.first_name, '') || ' ' || coalesce(new.last_name, ''), coalesce(new.email, ''));
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON user BEGIN
+         DELETE FROM user_search WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_au AFTER UPDATE OF first_name, last_name, email ON user BEGIN
+         UPDATE user_search
+         SET name = coalesce(new.first_name, '') || ' ' || coalesce(new.last_name, ''), email = coalesce(new.email, '')
+         WHERE rowid = new.id;
+       END""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS course_search
+       USING fts5(course_name, course_code, tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS course_search_ai AFTER INSERT ON course BEGIN
+         INSERT INTO course_search(rowid, course_name, course_code)
+         VALUES (new.id, coalesce(new.course_name, ''), coalesce(new.course_code, ''));
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS course_search_ad AFTER DELETE ON course BEGIN
+         DELETE FROM course_search WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS course_search_au AFTER UPDATE OF course_name, course_code ON course BEGIN
+         UPDATE course_search
+         SET course_name = coalesce(new.course_name, ''), course_code = coalesce(new.course_code, '')
+         WHERE rowid = new.id;
+       END""",
+]
+
+SQLITE_BACKFILL = [
+    """INSERT INTO user_search(rowid, name, email)
+       SELECT id, coalesce(first_name, '') || ' ' || coalesce(last_name, ''), coalesce(email, '') FROM user""",
+    """INSERT INTO course_search(rowid, course_name, course_code)
+       SELECT id, coalesce(course_name, ''), coalesce(course_code, '') FROM course""",
+]
+
+# postgres: trigram GIN indexes on the same lowered expressions the queries below filter on,
+# postgres keeps them up to date on its own
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS ix_user_search_trgm ON "user" USING gin
+       ((lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(email, ''))) gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS ix_course_search_trgm ON course USING gin
+       ((lower(coalesce(course_name, '') || ' ' || coalesce(course_code, ''))) gin_trgm_ops)""",
+]
+
+# trigram matching needs at least 3 characters, shorter queries fall back to LIKE
+MIN_INDEXED_QUERY = 3
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def install_search_index():
+    dialect = _dialect()
+    with db.engine.begin() as conn:
+        if dialect == "sqlite":
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_search'"
+            )).first()
+            for stmt in SQLITE_DDL:
+                conn.execute(text(stmt))
+            if not exists:
+                for stmt in SQLITE_BACKFILL:
+                    conn.execute(text(stmt))
+        elif dialect == "postgresql":
+            for stmt in POSTGRES_DDL:
+                conn.execute(text(stmt))
+
+
+def student_hay():
+    return func.lower(
+        func.coalesce(User.first_name, "") + " " + func.coalesce(User.last_name, "") + " " + func.coalesce(User.email, "")
+    )
+
+
+def course_hay():
+    return func.lower(func.coalesce(Course.course_name, "") + " " + func.coalesce(Course.course_code, ""))
+
+
+def _like_pattern(q):
+    escaped = q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _fts_phrase(q):
+    return '"' + q.replace('"', '""') + '"'
+
+
+def _use_fts(q):
+    return _dialect() == "sqlite" and len(q) >= MIN_INDEXED_QUERY
+
+
+def student_filter(q):
+    if _use_fts(q):
+        ids = text("SELECT rowid FROM user_search WHERE user_search MATCH :fts").bindparams(fts=_fts_phrase(q))
+        return User.id.in_(ids.columns(rowid=Integer))
+    return student_hay().like(_like_pattern(q), escape="\\")
+
+
+def _ranked(model, hay, fts_table, q, limit, *criteria):
+    if _use_fts(q):
+        fts = table(fts_table, column("rowid"), column("rank"))
+        ids = (
+            db.session.query(model.id)
+            .join(fts, fts.c.rowid == model.id)
+            .filter(literal_column(fts_table).op("MATCH")(_fts_phrase(q)), *criteria)
+            .order_by(fts.c.rank)
+            .limit(limit)
+            .all()
+        )
+        ids = [i for (i,) in ids]
+        by_id = {o.id: o for o in model.query.filter(model.id.in_(ids))} if ids else {}
+        return [by_id[i] for i in ids if i in by_id]
+
+    query = model.query.filter(hay.like(_like_pattern(q), escape="\\"), *criteria)
+    if _dialect() == "postgresql":
+        query = query.order_by(func.similarity(hay, q.lower()).desc(), model.id)
+    else:
+        query = query.order_by(model.id)
+    return query.limit(limit).all()
+
+
+def search(q, limit=20, instructor_id=None):
+    q = (q or "").strip()
+    if not q:
+        return {"students": [], "courses": []}
+
+    criteria = [User.role == "student"]
+    course_criteria = []
+    if instructor_id is not None:
+        # only the instructor's courses and the students in them
+        owned = select(CourseInstructor.course_id).where(CourseInstructor.instructor_id == instructor_id)
+        criteria.append(User.id.in_(select(Enrollment.user_id).where(Enrollment.course_id.in_(owned))))
+        course_criteria.append(Course.id.in_(owned))
+
+    students = _ranked(User, student_hay(), "user_search", q, limit, *criteria)
+    courses = _ranked(Course, course_hay(), "course_search", q, limit, *course_criteria)
+
+    return {
+        "students": [
+            {
+                "id": u.id,
+                "name": f"{u.first_name} {u.last_name}".strip(),
+                "email": u.email,
+                "role": u.role
+            }
+            for u in students
+        ],
+        "courses": [
+            {"id": c.id, "course_name": c.course_name, "course_code": c.course_code}
+            for c in courses
+        ]
+    }
@@ -0,0 +1,203 @@
+import glob
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import re
+import time
+from datetime import datetime
+
+import click
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger("Website.slowlog")
+logger.propagate = False
+
+_settings = {"threshold_ms": 0, "scans": False, "analyze": False}
+# fingerprint -> plan, so a statement shape is explained once per process
+_plans = {}
+MAX_PLANS = 5000
+
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s)"
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(_PLACEHOLDER), "?"),
+    # "IN (?, ?, ?)" grows with the list, every length is the same query
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?, ...)"),
+    (re.compile(r"\s+"), " "),
+]
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def normalize(statement):
+    for pattern, repl in _NORMALIZE:
+        statement = pattern.sub(repl, statement)
+    return statement.strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def _shape(parameters, executemany):
+    # types only, the values are student emails and grades
+    if executemany:
+        return {"many": len(parameters), "each": _shape(parameters[0], False) if parameters else None}
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+def _origin():
+    if has_request_context():
+        return request.endpoint or request.path
+    ctx = click.get_current_context(silent=True)
+    return f"cli:{ctx.info_name}" if ctx else None
+
+
+def _explain(dialect, cursor, statement, parameters):
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if dialect == "sqlite":
+            explain_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            return "\n".join(str(r[-1]) for r in explain_cursor.fetchall())
+
+        # a failed statement would abort the caller's transaction, the savepoint keeps it alive;
+        # ANALYZE runs the query again, so only for selects and rolled back either way
+        analyze = _settings["analyze"] and statement.lstrip().upper().startswith(("SELECT", "WITH"))
+        explain_cursor.execute("SAVEPOINT slowlog_explain")
+        try:
+            explain_cursor.execute(f"EXPLAIN {'ANALYZE ' if analyze else ''}{statement}", parameters)
+            return "\n".join(str(r[0]) for r in explain_cursor.fetchall())
+        finally:
+            explain_cursor.execute("ROLLBACK TO SAVEPOINT slowlog_explain")
+            explain_cursor.execute("RELEASE SAVEPOINT slowlog_explain")
+    except Exception as exc:
+        return f"explain failed: {type(exc).__name__}: {exc}"
+    finally:
+        explain_cursor.close()
+
+
+def full_scans(plan):
+    tables = []
+    for line in plan.splitlines():
+        line = line.strip(" -|`>")
+        match = _SQLITE_SCAN.match(line)
+        if match:
+            tables.append(match.group(1))
+        elif line.startswith("Seq Scan on "):
+            tables.append(line.split()[3])
+    # catalog lookups (table exists?) always scan and don't matter
+    return [t for t in tables if not t.startswith(("sqlite_", "pg_"))]
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_slowlog_started", []).append(time.perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("_slowlog_started")
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+
+    slow = _settings["threshold_ms"] and elapsed_ms >= _settings["threshold_ms"]
+    # a filter that reads the whole table is worth knowing about before it gets slow
+    check_scan = (
+        _settings["scans"] and not executemany
+        and statement.lstrip().upper().startswith(_EXPLAINABLE) and _WHERE.search(statement)
+    )
+    if not slow and not check_scan:
+        return
+
+    normalized = normalize(statement)
+    key = fingerprint(normalized)
+    if not slow and key in _plans:
+        return  # this shape was already checked
+
+    plan = None
+    if not executemany and statement.lstrip().upper().startswith(_EXPLAINABLE):
+        plan = None if _settings["analyze"] else _plans.get(key)
+        if plan is None:
+            plan = _explain(conn.dialect.name, cursor, statement, parameters)
+            if len(_plans) < MAX_PLANS:
+                _plans[key] = plan
+    scans = full_scans(plan) if plan else []
+    if not slow and not scans:
+        return
+
+    logger.warning(json.dumps({
+        "at": datetime.utcnow().isoformat(timespec="milliseconds"),
+        "kind": "slow" if slow else "full_scan",
+        "ms": round(elapsed_ms, 2),
+        "origin": _origin(),
+        "fingerprint": key,
+        "statement": normalized,
+        "params": _shape(parameters, executemany),
+        "full_scans": scans,
+        "plan": plan,
+    }))
+
+
+def init_slow_query_log(app):
+    _settings["threshold_ms"] = app.config.get("SLOW_QUERY_MS") or 0
+    _settings["scans"] = app.config.get("SLOW_QUERY_SCANS", False)
+    _settings["analyze"] = app.config.get("SLOW_QUERY_ANALYZE", False)
+    if not _settings["threshold_ms"] and not _settings["scans"]:
+        return
+
+    path = app.config["SLOW_QUERY_LOG"]
+    if not any(getattr(h, "baseFilename", None) == os.path.abspath(path) for h in logger.handlers):
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=app.config.get("SLOW_QUERY_LOG_BYTES", 5_000_000), backupCount=5, delay=True
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.WARNING)
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor):
+        event.listen(Engine, "before_cursor_execute", _before_cursor)
+        event.listen(Engine, "after_cursor_execute", _after_cursor)
+
+
+def read_entries(path):
+    # oldest rotation first: name.5 ... name.1, name
+    rotated = sorted(glob.glob(path + ".[0-9]*"), key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+    for name in rotated + ([path] if os.path.exists(path) else []):
+        with open(name) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def summarize(entries):
+    groups = {}
+    for e in entries:
+        g = groups.setdefault(e["fingerprint"], {
+            "fingerprint": e["fingerprint"], "statement": e["statement"], "count": 0, "slow": 0,
+            "total_ms": 0.0, "max_ms": 0.0, "origins": set(), "full_scans": set(), "plan": None
+        })
+        g["count"] += 1
+        if e["kind"] == "slow":
+            g["slow"] += 1
+            g["total_ms"] += e["ms"]
+            g["max_ms"] = max(g["max_ms"], e["ms"])
+        if e.get("origin"):
+            g["origins"].add(e["origin"])
+        g["full_scans"].update(e.get("full_scans") or ())
+        g["plan"] = e.get("plan") or g["plan"]
+    # full scans first (they are cheap to fix), then by time spent
+    return sorted(groups.values(), key=lambda g: (not g["full_scans"], -g["total_ms"]))
@@ -6,10 +6,19 @@ const calendarGrid = document.getElementById('calendarGrid');
 let currentDate = new Date();
 let userEvents = [];
 
+function visibleRange() {
+  const fmt = (d) => `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-01`;
+  const year = currentDate.getFullYear();
+  const month = currentDate.getMonth();
+  return { start: fmt(new Date(year, month, 1)), end: fmt(new Date(year, month + 1, 1)) };
+}
+
 async function fetchEvents() {
+  const { start, end } = visibleRange();
   try {
-    const response = await fetch('/api/events');
-    if (response.ok) {
+    const response = await fetch(`/api/events?start=${start}&end=${end}`);
+    // ignore answers for a month the user already navigated away from
+    if (response.ok && visibleRange().start === start) {
       userEvents = await response.json();
       renderCalendar();
     }
@@ -116,8 +125,11 @@ function handleEventClick(id) {
 }
 
 function changeMonth(dir) {
+  currentDate.setDate(1);
   currentDate.setMonth(currentDate.getMonth() + dir);
+  userEvents = [];
   renderCalendar();
+  fetchEvents();
 }
 
 
@@ -1,50 +1,58 @@
-from flask import Blueprint, render_template, request, url_for, redirect, flash, jsonify
+from flask import Blueprint, render_template, request, url_for, redirect, flash, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from .models import Course, Enrollment, CalendarEvent, User, Grade, Attendance, StudentInvite
+from .models import Course, Enrollment, CalendarEvent, Grade, Attendance
 from . import db
+from .risk import classify, course_thresholds, STUDENT_THRESHOLDS, HIGH, MED, LOW
+from .cache import cached_for_user, bump_users, bump_cohort
+from .loaders import load_dashboard, load_enrollments, load_instructor_names, iter_calendar_items
+from .routing import replica_reads
 from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+import json
 
 student_views = Blueprint('student_views', __name__)
 
+RISK_TEXTS = ("High Risk", "Moderate", "Low Risk")
+RISK_BADGES = ("danger", "warn", "good")
+
+
+def _student_levels(enrollments):
+    # a course with its own cutoffs uses them here too, the rest keep the student defaults
+    return classify(
+        [e.attendance_rate for e in enrollments],
+        [e.current_grade for e in enrollments],
+        [e.course_id for e in enrollments],
+        thresholds=STUDENT_THRESHOLDS,
+        table=course_thresholds()
+    )
+
 @student_views.route('/student-dashboard')
 @login_required
 def dashboard():
+    today = datetime.utcnow().date()
+    context = cached_for_user(current_user.id, "dashboard", lambda: _dashboard_context(current_user, today), today)
+    return render_template("studenthomepage.html", user=current_user, active_page="dashboard", **context)
+
 
-    student_enrollments = Enrollment.query.filter_by(user_id=current_user.id).all()
+def _dashboard_context(user, today):
+    data = load_dashboard(user, today)
+
+    student_enrollments = data["enrollments"]
     total_courses = len(student_enrollments)
 
     total_attendance = 0
     if total_courses > 0:
         total_attendance = sum(e.attendance_rate for e in student_enrollments) / total_courses
 
-    instructor_by_course = {}
-    if current_user.email:
-        accepted_invites = (
-            StudentInvite.query
-            .filter_by(student_email=current_user.email, accepted=True)
-            .order_by(StudentInvite.accepted_at.desc())
-            .all()
-        )
-        for inv in accepted_invites:
-            if inv.course_id and inv.course_id not in instructor_by_course:
-                inst = User.query.get(inv.instructor_id)
-                if inst:
-                    instructor_by_course[inv.course_id] = f"{inst.first_name} {inst.last_name}".strip()
+    instructor_by_course = data["instructors"]
+
+    levels = _student_levels(student_enrollments)
+    alert_count = int((levels != LOW).sum())
 
     processed_courses = []
-    alert_count = 0
-    for e in student_enrollments:
-        if e.attendance_rate < 70 or e.current_grade < 65:
-            risk_class = "status-badge status-danger"
-            risk_text = "High Risk"
-            alert_count += 1
-        elif e.attendance_rate < 85 or e.current_grade < 75:
-            risk_class = "status-badge status-warn"
-            risk_text = "Moderate"
-            alert_count += 1
-        else:
-            risk_class = "status-badge status-good"
-            risk_text = "Low Risk"
+    for e, level in zip(student_enrollments, levels.tolist()):
+        risk_class = "status-badge status-" + RISK_BADGES[level]
+        risk_text = RISK_TEXTS[level]
 
         icon_text = (e.course.course_code[:2].upper() if e.course.course_code else e.course.course_name[:2].upper())
         instructor_name = instructor_by_course.get(e.course_id, "Not assigned")
@@ -60,41 +68,23 @@ def dashboard():
             "risk_text": risk_text,
         })
 
-    today = datetime.utcnow().date()
-    
-
     all_events = []
 
-   
-    manual_events = CalendarEvent.query.filter(
-        CalendarEvent.user_id == current_user.id,
-        CalendarEvent.event_date >= datetime.combine(today, datetime.min.time())
-    ).all()
-
-    for e in manual_events:
-        e_date = e.event_date.date()
-        days_diff = (e_date - today).days
-        if 0 <= days_diff < 7:
-            all_events.append({
-                "title": e.title,
-                "date": e_date,
-                "pretty": e.event_date.strftime("%b %d"),
-                "type": e.event_type or "Deadline"
-            })
+    for e in data["events"]:
+        all_events.append({
+            "title": e.title,
+            "date": e.event_date.date(),
+            "pretty": e.event_date.strftime("%b %d"),
+            "type": e.event_type or "Deadline"
+        })
 
-    
-    for enr in student_enrollments:
-        c_name = enr.course.course_name if enr.course else "Course"
-        for g in enr.grades:
-            if g.date_recorded:
-                days_diff = (g.date_recorded - today).days
-                if 0 <= days_diff < 7:
-                    all_events.append({
-                        "title": f"{c_name} - {g.exam_name}",
-                        "date": g.date_recorded,
-                        "pretty": g.date_recorded.strftime("%b %d"),
-                        "type": "Exam"
-                    })
+    for exam_name, date_recorded, course_name in data["grades"]:
+        all_events.append({
+            "title": f"{course_name or 'Course'} - {exam_name}",
+            "date": date_recorded,
+            "pretty": date_recorded.strftime("%b %d"),
+            "type": "Exam"
+        })
 
     all_events.sort(key=lambda x: x['date'])
 
@@ -110,17 +100,14 @@ def dashboard():
             "count": len(d_events)
         })
 
-    return render_template(
-        "studenthomepage.html",
-        user=current_user,
-        courses=processed_courses,
-        total_courses=total_courses,
-        alert_count=alert_count,
-        overall_attendance=round(total_attendance, 1),
-        week_days=week_days,
-        upcoming_7=all_events,
-        active_page="dashboard"
-    )
+    return {
+        "courses": processed_courses,
+        "total_courses": total_courses,
+        "alert_count": alert_count,
+        "overall_attendance": round(total_attendance, 1),
+        "week_days": week_days,
+        "upcoming_7": all_events
+    }
 
 @student_views.route('/courses')
 @login_required
@@ -167,8 +154,18 @@ def enroll():
 
     existing = Enrollment.query.filter_by(user_id=current_user.id, course_id=course.id).first()
     if not existing:
-        db.session.add(Enrollment(user_id=current_user.id, course_id=course.id))
-        db.session.commit()
+        enrollment = Enrollment(user_id=current_user.id, course_id=course.id)
+        enrollment.refresh_risk()
+        db.session.add(enrollment)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a double submitted form lost the race against uq_enrollment_user_course
+            db.session.rollback()
+            flash("You are already enrolled in this course.", "info")
+            return redirect(url_for('student_views.courses'))
+        bump_users(current_user.id)
+        bump_cohort()
         flash("Enrolled successfully!", "success")
     else:
         flash("You are already enrolled in this course.", "info")
@@ -191,13 +188,11 @@ def add_grade():
         )
         db.session.add(new_grade)
 
-        all_grades = Grade.query.filter_by(enrollment_id=enrollment.id).all()
-        total_weight = sum(g.weight for g in all_grades)
-        if total_weight > 0:
-            weighted_sum = sum(g.score * (g.weight / 100) for g in all_grades)
-            enrollment.current_grade = (weighted_sum / (total_weight / 100))
-
+        enrollment.apply_grade(new_grade.score, new_grade.weight)
+        enrollment.refresh_risk()
         db.session.commit()
+        bump_users(current_user.id)
+        bump_cohort()
         flash("Grade successfully added!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -216,12 +211,11 @@ def add_attendance():
         )
         db.session.add(new_attendance)
 
-        all_att = Attendance.query.filter_by(enrollment_id=enrollment.id).all()
-        if all_att:
-            present_days = sum(1 for a in all_att if a.status == 'present')
-            enrollment.attendance_rate = (present_days / len(all_att)) * 100
-
+        enrollment.apply_attendance(new_attendance.status)
+        enrollment.refresh_risk()
         db.session.commit()
+        bump_users(current_user.id)
+        bump_cohort()
         flash("Attendance recorded!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -239,6 +233,9 @@ def edit_enrollment():
         enrollment.course.course_name = course_name
         enrollment.course.course_code = course_code
         db.session.commit()
+        # the course name shows up on every enrolled student's dashboard
+        bump_users(*[uid for (uid,) in db.session.query(Enrollment.user_id).filter_by(course_id=enrollment.course_id)])
+        bump_cohort()
         flash("Enrollment updated successfully!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -252,6 +249,8 @@ def delete_enrollment():
     if enrollment:
         db.session.delete(enrollment)
         db.session.commit()
+        bump_users(current_user.id)
+        bump_cohort()
         flash("Enrollment deleted successfully!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -265,15 +264,16 @@ def edit_attendance():
     if attendance:
         enrollment = Enrollment.query.filter_by(id=attendance.enrollment_id, user_id=current_user.id).first()
         if enrollment:
+            enrollment.apply_attendance(attendance.status, -1)
+
             attendance.date = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
             attendance.status = request.form.get('status')
             
-            all_att = Attendance.query.filter_by(enrollment_id=enrollment.id).all()
-            if all_att:
-                present_days = sum(1 for a in all_att if a.status == 'present')
-                enrollment.attendance_rate = (present_days / len(all_att)) * 100
-            
+            enrollment.apply_attendance(attendance.status)
+            enrollment.refresh_risk()
             db.session.commit()
+            bump_users(current_user.id)
+            bump_cohort()
             flash("Attendance updated successfully!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -289,14 +289,11 @@ def delete_attendance():
         if enrollment:
             db.session.delete(attendance)
             
-            all_att = Attendance.query.filter_by(enrollment_id=enrollment.id).all()
-            if all_att:
-                present_days = sum(1 for a in all_att if a.status == 'present')
-                enrollment.attendance_rate = (present_days / len(all_att)) * 100
-            else:
-                enrollment.attendance_rate = 0
-            
+            enrollment.apply_attendance(attendance.status, -1)
+            enrollment.refresh_risk()
             db.session.commit()
+            bump_users(current_user.id)
+            bump_cohort()
             flash("Attendance deleted successfully!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -310,18 +307,18 @@ def edit_grade():
     if grade:
         enrollment = Enrollment.query.filter_by(id=grade.enrollment_id, user_id=current_user.id).first()
         if enrollment:
+            enrollment.apply_grade(grade.score, grade.weight, -1)
+
             grade.exam_name = request.form.get('exam_name')
             grade.score = float(request.form.get('score'))
             grade.weight = float(request.form.get('weight'))
             grade.date_recorded = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
             
-            all_grades = Grade.query.filter_by(enrollment_id=enrollment.id).all()
-            total_weight = sum(g.weight for g in all_grades)
-            if total_weight > 0:
-                weighted_sum = sum(g.score * (g.weight / 100) for g in all_grades)
-                enrollment.current_grade = (weighted_sum / (total_weight / 100))
-            
+            enrollment.apply_grade(grade.score, grade.weight)
+            enrollment.refresh_risk()
             db.session.commit()
+            bump_users(current_user.id)
+            bump_cohort()
             flash("Grade updated successfully!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -337,16 +334,11 @@ def delete_grade():
         if enrollment:
             db.session.delete(grade)
             
-            all_grades = Grade.query.filter_by(enrollment_id=enrollment.id).all()
-            if all_grades:
-                total_weight = sum(g.weight for g in all_grades)
-                if total_weight > 0:
-                    weighted_sum = sum(g.score * (g.weight / 100) for g in all_grades)
-                    enrollment.current_grade = (weighted_sum / (total_weight / 100))
-            else:
-                enrollment.current_grade = 0
-            
+            enrollment.apply_grade(grade.score, grade.weight, -1)
+            enrollment.refresh_risk()
             db.session.commit()
+            bump_users(current_user.id)
+            bump_cohort()
             flash("Grade deleted successfully!", "success")
 
     return redirect(url_for('student_views.courses'))
@@ -371,6 +363,7 @@ def update_settings():
 
 @student_views.route('/api/events', methods=['GET', 'POST'])
 @login_required
+@replica_reads
 def manage_events():
     if request.method == 'POST':
         data = request.json
@@ -382,50 +375,37 @@ def manage_events():
         )
         db.session.add(new_event)
         db.session.commit()
+        bump_users(current_user.id)
         return jsonify({"status": "success"})
 
-    
-    events_list = []
+    # defaults to the month being shown: [start, end) with end exclusive
+    try:
+        start = datetime.strptime(request.args["start"], '%Y-%m-%d').date() if request.args.get("start") else None
+        end = datetime.strptime(request.args["end"], '%Y-%m-%d').date() if request.args.get("end") else None
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD"}), 400
+    month_start, month_end = _month_window(start or datetime.utcnow().date())
+    start = start or month_start
+    end = end or month_end
+    if end <= start:
+        return jsonify({"error": "end must be after start"}), 400
 
-    
-    manual_events = CalendarEvent.query.filter_by(user_id=current_user.id).all()
-    for e in manual_events:
-        events_list.append({
-            "id": e.id,
-            "title": e.title,
-            "date": e.event_date.strftime('%Y-%m-%d'),
-            "type": e.event_type,
-            "is_manual": True
-        })
+    return Response(stream_with_context(_json_array(iter_calendar_items(current_user.id, start, end))), mimetype="application/json")
 
-    
-    enrollments = Enrollment.query.filter_by(user_id=current_user.id).all()
-    for enr in enrollments:
-        course_name = enr.course.course_name if enr.course else "Course"
-
-       
-        for g in enr.grades:
-            if g.date_recorded:
-                events_list.append({
-                    "id": None,
-                    "title": f"{course_name} - {g.exam_name}",
-                    "date": g.date_recorded.strftime('%Y-%m-%d'),
-                    "type": "Exam",
-                    "is_manual": False
-                })
 
-        
-        for a in enr.attendance_records:
-            if a.date:
-                events_list.append({
-                    "id": None,
-                    "title": f"{course_name} - {a.status}",
-                    "date": a.date.strftime('%Y-%m-%d'),
-                    "type": "Attendance",
-                    "is_manual": False
-                })
-
-    return jsonify(events_list)
+def _month_window(day):
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def _json_array(items):
+    yield "["
+    sep = ""
+    for item in items:
+        yield sep + json.dumps(item)
+        sep = ","
+    yield "]"
 
 @student_views.route('/api/events/<int:event_id>', methods=['PUT', 'DELETE'])
 @login_required
@@ -437,6 +417,7 @@ def modify_event(event_id):
     if request.method == 'DELETE':
         db.session.delete(event)
         db.session.commit()
+        bump_users(current_user.id)
         return jsonify({"status": "deleted"})
 
     if request.method == 'PUT':
@@ -446,52 +427,40 @@ def modify_event(event_id):
             event.event_date = datetime.strptime(data['date'], '%Y-%m-%d')
         event.event_type = data.get('type', event.event_type)
         db.session.commit()
+        bump_users(current_user.id)
         return jsonify({"status": "updated"})
 
 @student_views.route('/run-scan')
 @login_required
 def run_scan():
-    enrollments = Enrollment.query.filter_by(user_id=current_user.id).all()
-    
-    
-    instructor_by_course = {}
-    if current_user.email:
-        accepted_invites = (
-            StudentInvite.query
-            .filter_by(student_email=current_user.email, accepted=True)
-            .order_by(StudentInvite.accepted_at.desc())
-            .all()
-        )
-        for inv in accepted_invites:
-            if inv.course_id and inv.course_id not in instructor_by_course:
-                inst = User.query.get(inv.instructor_id)
-                if inst:
-                    instructor_by_course[inv.course_id] = f"{inst.first_name} {inst.last_name}".strip()
+    return jsonify(cached_for_user(current_user.id, "scan", lambda: _scan_result(current_user)))
+
+
+def _scan_result(user):
+    enrollments = load_enrollments(user.id)
+    instructor_by_course = load_instructor_names(user.id)
 
     alerts = []
     analysis = []
 
-    for e in enrollments:
+    levels = _student_levels(enrollments)
+
+    for e, level in zip(enrollments, levels.tolist()):
         instructor_name = instructor_by_course.get(e.course_id, "Not assigned")
         icon_text = (e.course.course_code[:2].upper() if e.course.course_code else e.course.course_name[:2].upper())
 
-        if e.attendance_rate < 70 or e.current_grade < 65:
-            risk_text = "High Risk"
-            risk_class = "danger"
+        risk_text = RISK_TEXTS[level]
+        risk_class = RISK_BADGES[level]
+        if level == HIGH:
             alerts.append({
                 "level": "High",
                 "message": f"Critical: {e.course.course_name} (Grade: {e.current_grade}%, Att: {e.attendance_rate}%)"
             })
-        elif e.attendance_rate < 85 or e.current_grade < 75:
-            risk_text = "Moderate"
-            risk_class = "warn"
+        elif level == MED:
             alerts.append({
                 "level": "Moderate",
                 "message": f"Warning: {e.course.course_name} is at Moderate Risk."
             })
-        else:
-            risk_text = "Low Risk"
-            risk_class = "good"
 
         analysis.append({
             "course": e.course.course_name,
@@ -504,4 +473,4 @@ def run_scan():
             "grade": round(e.current_grade, 1)
         })
 
-    return jsonify({"alerts": alerts, "analysis": analysis})
\ No newline at end of file
+    return {"alerts": alerts, "analysis": analysis}
\ No newline at end of file
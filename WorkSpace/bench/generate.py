@@ -0,0 +1,215 @@
+"""Fill the database behind DATABASE_URL with a synthetic university.
+
+    python -m bench.generate --scale 10k --reset
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, func, text
+from werkzeug.security import generate_password_hash
+
+from Website import create_app, db
+from Website.models import (
+    User, Course, Enrollment, Grade, Attendance, CalendarEvent, StudentInvite, CourseInstructor, sort_name
+)
+from Website.risk import risk_level, course_thresholds, INSTRUCTOR_THRESHOLDS
+from Website.migrations import init_db
+
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+PASSWORD = "Bench-pass1!"
+BATCH_STUDENTS = 1_000
+EXAMS = ("Quiz 1", "Midterm", "Quiz 2", "Project", "Final", "Lab")
+EVENT_TYPES = ("Study", "Deadline", "Meeting", "Exam")
+
+
+class Ids:
+    # ids are handed out here so child rows can be written without reading anything back
+    def __init__(self):
+        self.next = {}
+
+    def take(self, model, n=1):
+        start = self.next.get(model, 1)
+        self.next[model] = start + n
+        return range(start, start + n)
+
+
+def _insert(model, rows):
+    if rows:
+        db.session.execute(insert(model), rows)
+
+
+def _fix_sequences(models):
+    if db.engine.dialect.name != "postgresql":
+        return
+    for model in models:
+        table = model.__table__.name
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), coalesce(max(id), 1)) FROM \"{table}\""
+        ))
+
+
+def _make_courses(rng, ids, n_courses, n_instructors, password):
+    instructors = [
+        {
+            "id": i, "first_name": f"Instructor{n}", "last_name": rng.choice(("Haddad", "Khoury", "Saad", "Nasr")),
+            "email": f"instructor{n}@bench.local", "password": password, "role": "instructor",
+            "choose_role": True, "email_verified": True
+        }
+        for n, i in enumerate(ids.take(User, n_instructors))
+    ]
+    courses = [
+        {"id": i, "course_name": f"Course {n:04d}", "course_code": f"BC{n:04d}"}
+        for n, i in enumerate(ids.take(Course, n_courses))
+    ]
+    owners = []
+    for n, course in enumerate(courses):
+        owner = instructors[n % n_instructors]["id"]
+        owners.append({"id": ids.take(CourseInstructor)[0], "course_id": course["id"], "instructor_id": owner, "created_at": datetime.utcnow()})
+    _insert(User, instructors)
+    _insert(Course, courses)
+    _insert(CourseInstructor, owners)
+    return [c["id"] for c in courses], {o["course_id"]: o["instructor_id"] for o in owners}
+
+
+def _student_batch(rng, ids, first, count, args, course_ids, owner_of, password, thresholds, today):
+    users, enrollments, grades, attendance, events, invites = [], [], [], [], [], []
+    term_start = today - timedelta(days=args.days * 3)
+
+    for n, user_id in zip(range(first, first + count), ids.take(User, count)):
+        email = f"student{n}@bench.local"
+        last_name = rng.choice(("Ali", "Farah", "Mansour", "Daher", "Aoun"))
+        users.append({
+            "id": user_id, "first_name": f"Student{n}", "last_name": last_name,
+            "email": email, "password": password, "role": "student", "choose_role": True, "email_verified": True
+        })
+
+        # each student has a habit: most attend and pass, a tail does neither
+        attend_p = min(1.0, max(0.2, rng.gauss(0.85, 0.15)))
+        skill = min(100.0, max(20.0, rng.gauss(74, 15)))
+
+        for course_id in rng.sample(course_ids, min(len(course_ids), rng.randint(args.min_courses, args.max_courses))):
+            enrollment_id = ids.take(Enrollment)[0]
+
+            weighted, weights = 0.0, 0.0
+            for exam in EXAMS[:args.grades]:
+                score = round(min(100.0, max(0.0, rng.gauss(skill, 10))), 1)
+                weight = rng.choice((10.0, 15.0, 20.0, 30.0))
+                weighted += score * weight
+                weights += weight
+                grades.append({
+                    "id": ids.take(Grade)[0], "enrollment_id": enrollment_id, "exam_name": exam,
+                    "score": score, "weight": weight, "date_recorded": term_start + timedelta(days=rng.randint(0, args.days * 4))
+                })
+
+            present = 0
+            for d in range(args.days):
+                status = "present" if rng.random() < attend_p else "absent"
+                present += status == "present"
+                attendance.append({
+                    "id": ids.take(Attendance)[0], "enrollment_id": enrollment_id,
+                    "date": term_start + timedelta(days=d * 3), "status": status
+                })
+
+            rate = (present / args.days) * 100 if args.days else 100.0
+            grade = weighted / weights if weights else 0.0
+            enrollments.append({
+                "id": enrollment_id, "user_id": user_id, "course_id": course_id,
+                "sort_name": sort_name(f"Student{n}", last_name),
+                "attendance_rate": rate, "current_grade": grade,
+                "weighted_score_sum": weighted, "total_weight": weights,
+                "present_count": present, "total_count": args.days,
+                "risk_level": risk_level(rate, grade, thresholds.get(course_id, INSTRUCTOR_THRESHOLDS)),
+                "risk_updated_at": datetime.utcnow()
+            })
+
+            if rng.random() < args.invite_ratio:
+                accepted = rng.random() < 0.8
+                invites.append({
+                    "id": ids.take(StudentInvite)[0], "instructor_id": owner_of[course_id], "student_email": email,
+                    "course_id": course_id, "token": f"bench-{enrollment_id}", "accepted": accepted,
+                    "accepted_at": datetime.utcnow() if accepted else None,
+                    "expires_at": datetime.utcnow() + timedelta(days=3), "created_at": datetime.utcnow()
+                })
+
+        for _ in range(args.events):
+            events.append({
+                "id": ids.take(CalendarEvent)[0], "user_id": user_id, "title": rng.choice(("Study group", "Assignment due", "Office hours")),
+                "event_date": datetime.combine(today + timedelta(days=rng.randint(-30, 60)), datetime.min.time()),
+                "event_type": rng.choice(EVENT_TYPES)
+            })
+
+    for model, rows in ((User, users), (Enrollment, enrollments), (Grade, grades),
+                        (Attendance, attendance), (CalendarEvent, events), (StudentInvite, invites)):
+        _insert(model, rows)
+    return len(enrollments), len(grades), len(attendance)
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    ids = Ids()
+    password = generate_password_hash(PASSWORD)
+    thresholds = course_thresholds()
+    today = date.today()
+
+    n_courses = args.courses or max(10, args.students // 40)
+    n_instructors = args.instructors or max(1, n_courses // 4)
+    course_ids, owner_of = _make_courses(rng, ids, n_courses, n_instructors, password)
+    db.session.commit()
+
+    totals = [0, 0, 0]
+    started = time.perf_counter()
+    for first in range(0, args.students, BATCH_STUDENTS):
+        count = min(BATCH_STUDENTS, args.students - first)
+        added = _student_batch(rng, ids, first, count, args, course_ids, owner_of, password, thresholds, today)
+        db.session.commit()
+        totals = [t + a for t, a in zip(totals, added)]
+        print(f"  {first + count}/{args.students} students", file=sys.stderr)
+
+    _fix_sequences((User, Course, Enrollment, Grade, Attendance, CalendarEvent, StudentInvite, CourseInstructor))
+    db.session.commit()
+    print(
+        f"{args.students} students, {n_courses} courses, {n_instructors} instructors, "
+        f"{totals[0]} enrollments, {totals[1]} grades, {totals[2]} attendance rows "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), help="shorthand for --students")
+    parser.add_argument("--students", type=int, default=1_000)
+    parser.add_argument("--courses", type=int, default=0, help="default: students / 40")
+    parser.add_argument("--instructors", type=int, default=0, help="default: courses / 4")
+    parser.add_argument("--min-courses", type=int, default=3)
+    parser.add_argument("--max-courses", type=int, default=6)
+    parser.add_argument("--grades", type=int, default=4, help=f"grades per enrollment (max {len(EXAMS)})")
+    parser.add_argument("--days", type=int, default=20, help="attendance records per enrollment")
+    parser.add_argument("--events", type=int, default=3, help="calendar events per student")
+    parser.add_argument("--invite-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop every table first")
+    args = parser.parse_args(argv)
+    if args.scale:
+        args.students = SCALES[args.scale]
+    args.grades = min(args.grades, len(EXAMS))
+
+    app = create_app()
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            # the sqlite search tables are not part of the models
+            for table in ("user_search", "course_search"):
+                db.session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            db.session.commit()
+        init_db()
+        if not args.reset and db.session.query(func.count(User.id)).scalar():
+            parser.error("the database already has users, pass --reset to start over")
+        generate(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Drive every route through the Flask test client and report latency, queries and memory.
+
+    python -m bench.run --repeat 30 --save bench/baseline.json
+    python -m bench.run --compare bench/baseline.json
+    python -m bench.run --startup-budget 800 --startup-runs 10
+
+bench/baseline.json was recorded on sqlite against the 10k data set with seed 42:
+
+    python -m bench.generate --scale 10k --seed 42 --reset
+    python -m bench.run --repeat 30 --save bench/baseline.json
+
+compare against it on the same data set; the timings are only meaningful on similar hardware.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import event, func
+
+from Website import create_app, db
+from Website.models import User, Enrollment, CourseInstructor
+from Website.cache import cache
+from bench.generate import PASSWORD
+
+
+# run in a fresh interpreter, the way a gunicorn worker (or the --preload master) boots
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+queries = []
+event.listen(Engine, "before_cursor_execute", lambda *args: queries.append(1))
+from Website import create_app
+create_app()
+print(json.dumps({
+    "ms": (time.perf_counter() - started) * 1000,
+    "queries": len(queries),
+    "modules": len(sys.modules),
+    "deferred_loaded": [m for m in ("smtplib", "xlsxwriter") if m in sys.modules],
+}))
+"""
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def _context():
+    # the busiest instructor and one of their students, so every page has real rows to show
+    instructor_id, _ = (
+        db.session.query(CourseInstructor.instructor_id, func.count(CourseInstructor.id))
+        .group_by(CourseInstructor.instructor_id)
+        .order_by(func.count(CourseInstructor.id).desc())
+        .first()
+    )
+    enrollment = (
+        Enrollment.query
+        .join(CourseInstructor, CourseInstructor.course_id == Enrollment.course_id)
+        .filter(CourseInstructor.instructor_id == instructor_id)
+        .order_by(Enrollment.id)
+        .first()
+    )
+    student = db.session.get(User, enrollment.user_id)
+    return {
+        "instructor_id": instructor_id,
+        "student_id": student.id,
+        "student_email": student.email,
+        "enrollment_id": enrollment.id,
+        "course_id": enrollment.course_id,
+        "search": (student.first_name or "")[:5],
+        "month_start": date.today().replace(day=1).isoformat(),
+    }
+
+
+def scenarios(ctx, writes=False):
+    # (name, who is logged in, method, url, request kwargs)
+    routes = [
+        ("intro", None, "GET", "/", {}),
+        ("login page", None, "GET", "/login", {}),
+        ("signup page", None, "GET", "/signup", {}),
+        ("login", None, "POST", "/login", {"data": {"email": ctx["student_email"], "password": PASSWORD}}),
+
+        ("student dashboard", "student", "GET", "/student-dashboard", {}),
+        ("student courses", "student", "GET", "/courses", {}),
+        ("student calendar", "student", "GET", "/calender", {}),
+        ("calendar events", "student", "GET", f"/api/events?start={ctx['month_start']}", {}),
+        ("risk scan", "student", "GET", "/run-scan", {}),
+        ("student settings", "student", "GET", "/student_settings", {}),
+
+        ("instructor dashboard", "instructor", "GET", "/instructor", {}),
+        ("roster", "instructor", "GET", "/Instructor_students", {}),
+        ("roster high risk", "instructor", "GET", "/Instructor_students?risk=high", {}),
+        ("roster search", "instructor", "GET", f"/Instructor_students?q={ctx['search']}", {}),
+        ("reports", "instructor", "GET", "/reports", {}),
+        ("search api", "instructor", "GET", f"/api/search?q={ctx['search']}", {}),
+        ("roster export", "instructor", "GET", "/export/roster", {}),
+        ("report export", "instructor", "GET", "/export/report", {}),
+        ("instructor settings", "instructor", "GET", "/instructor_settings", {}),
+    ]
+    if writes:
+        today = date.today().isoformat()
+        routes += [
+            ("add grade", "student", "POST", "/add-grade",
+             {"data": {"enrollment_id": ctx["enrollment_id"], "exam_name": "Bench", "score": "80", "weight": "5", "date": today}}),
+            ("add attendance", "student", "POST", "/add-attendance",
+             {"data": {"enrollment_id": ctx["enrollment_id"], "status": "present", "date": today}}),
+            ("add event", "student", "POST", "/api/events",
+             {"json": {"title": "Bench", "date": today, "type": "Study"}}),
+            ("roll call", "instructor", "POST", "/api/roll-call",
+             {"json": {"course_id": ctx["course_id"], "date": today, "statuses": {ctx["student_email"]: "present"}}}),
+            ("invite", "instructor", "POST", "/invite-student",
+             {"data": {"student_email": "bench-invite@bench.local", "course_id": ctx["course_id"]}}),
+        ]
+    return routes
+
+
+def _client(app, user_id):
+    client = app.test_client()
+    if user_id:
+        with client.session_transaction() as s:
+            s["_user_id"] = str(user_id)
+            s["_fresh"] = True
+    return client
+
+
+def _call(client, method, url, kwargs):
+    response = client.open(url, method=method, **kwargs)
+    response.get_data()  # drain streamed bodies so they are part of the timing
+    response.close()
+    return response
+
+
+def _invalidate(app, user_ids):
+    with app.app_context():
+        cache().bump("cohort", *(f"user:{i}" for i in user_ids))
+
+
+def measure(app, client, method, url, kwargs, repeat, warmup, counter, cold):
+    for _ in range(warmup):
+        _call(client, method, url, kwargs)
+
+    times, queries, status = [], [], None
+    for _ in range(repeat):
+        if cold:
+            _invalidate(app, cold)
+        counter.count = 0
+        started = time.perf_counter()
+        status = _call(client, method, url, kwargs).status_code
+        times.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+
+    # one extra pass under tracemalloc, it slows requests down too much to time them with it on
+    if cold:
+        _invalidate(app, cold)
+    tracemalloc.start()
+    _call(client, method, url, kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {
+        "status": status,
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(np.mean(times)), 2),
+        "queries": int(np.median(queries)),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def startup(runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples, wall = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT], cwd=root, capture_output=True, text=True, check=True
+        ).stdout
+        wall.append((time.perf_counter() - started) * 1000)
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+
+    return {
+        "p50_ms": round(float(np.median([s["ms"] for s in samples])), 1),
+        "max_ms": round(max(s["ms"] for s in samples), 1),
+        "process_ms": round(float(np.median(wall)), 1),
+        "queries": max(s["queries"] for s in samples),
+        "modules": samples[-1]["modules"],
+        "deferred_loaded": samples[-1]["deferred_loaded"],
+    }
+
+
+def check_startup(r, budget_ms):
+    problems = []
+    if r["p50_ms"] > budget_ms:
+        problems.append(f"startup: {r['p50_ms']}ms is over the {budget_ms}ms budget")
+    if r["queries"]:
+        problems.append(f"startup: create_app ran {r['queries']} queries, the database belongs to `flask init-db`")
+    if r["deferred_loaded"]:
+        problems.append(f"startup: imported {', '.join(r['deferred_loaded'])} at boot")
+    return problems
+
+
+def compare(results, baseline, tolerance, min_ms=1.0, min_kb=64.0):
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        # the median is compared, p95 of a few dozen runs is mostly scheduler noise
+        if r["p50_ms"] > b["p50_ms"] * (1 + tolerance) and r["p50_ms"] - b["p50_ms"] > min_ms:
+            regressions.append(f"{name}: p50 {b['p50_ms']}ms -> {r['p50_ms']}ms")
+        if r["queries"] > b["queries"]:
+            regressions.append(f"{name}: queries {b['queries']} -> {r['queries']}")
+        if r["peak_kb"] > b["peak_kb"] * (1 + tolerance) and r["peak_kb"] - b["peak_kb"] > min_kb:
+            regressions.append(f"{name}: peak {b['peak_kb']}KB -> {r['peak_kb']}KB")
+        if r["status"] != b["status"]:
+            regressions.append(f"{name}: status {b['status']} -> {r['status']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--only", help="comma separated route names")
+    parser.add_argument("--writes", action="store_true", help="include routes that write (the data grows)")
+    parser.add_argument("--cold", action="store_true", help="invalidate the caches before every request")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against, exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50/memory growth, 0.25 = 25%%")
+    parser.add_argument("--startup-runs", type=int, default=5, help="cold starts to time, 0 to skip")
+    parser.add_argument("--startup-budget", type=float, default=1000, help="max median create_app time in ms")
+    args = parser.parse_args(argv)
+
+    startup_result, problems = None, []
+    if args.startup_runs:
+        startup_result = startup(args.startup_runs)
+        problems = check_startup(startup_result, args.startup_budget)
+        print(
+            f"cold start {startup_result['p50_ms']}ms (max {startup_result['max_ms']}ms, "
+            f"process {startup_result['process_ms']}ms, {startup_result['modules']} modules, "
+            f"{startup_result['queries']} queries)"
+        )
+
+    app = create_app()
+    app.config["TESTING"] = True
+    results = {}
+    with app.app_context():
+        if not db.session.query(CourseInstructor.id).first():
+            parser.error("no data, run `python -m bench.generate` first")
+        ctx = _context()
+        counts = {
+            "students": db.session.query(func.count(User.id)).filter(User.role == "student").scalar(),
+            "enrollments": db.session.query(func.count(Enrollment.id)).scalar(),
+            "database": db.engine.dialect.name,
+        }
+        counter = QueryCounter(db.engine)
+
+    # requests run outside any app context: sharing one would share db.session and flask.g
+    # (and with it the logged in user) between requests
+    clients = {
+        "student": _client(app, ctx["student_id"]),
+        "instructor": _client(app, ctx["instructor_id"]),
+    }
+    only = set(args.only.split(",")) if args.only else None
+    cold = (ctx["student_id"], ctx["instructor_id"]) if args.cold else ()
+
+    print(f"{'route':<22}{'status':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'peak KB':>10}")
+    for name, who, method, url, kwargs in scenarios(ctx, args.writes):
+        if only and name not in only:
+            continue
+        # a fresh client per anonymous route keeps "login" from carrying its session forward
+        client = _client(app, None) if who is None else clients[who]
+        r = measure(app, client, method, url, kwargs, args.repeat, args.warmup, counter, cold)
+        results[name] = r
+        print(f"{name:<22}{r['status']:>7}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['queries']:>9}{r['peak_kb']:>10}")
+
+    report = {
+        "meta": {
+            "when": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "repeat": args.repeat,
+            "cold": args.cold,
+            **counts,
+        },
+        "routes": results,
+        "startup": startup_result,
+    }
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("enrollments") != counts["enrollments"]:
+            print("warning: baseline was recorded on a different data set", file=sys.stderr)
+        problems += compare(results, baseline["routes"], args.tolerance)
+        before = baseline.get("startup")
+        if startup_result and before and startup_result["p50_ms"] > before["p50_ms"] * (1 + args.tolerance):
+            problems.append(f"startup: p50 {before['p50_ms']}ms -> {startup_result['p50_ms']}ms")
+
+    for line in problems:
+        print(f"REGRESSION {line}")
+    if problems:
+        sys.exit(1)
+    if args.compare:
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
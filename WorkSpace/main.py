@@ -3,6 +3,10 @@ from Website import create_app
 app = create_app()
 
 if __name__ == '__main__':
+    # the dev server sets up its own database, in production run `flask init-db` on deploy
+    from Website.migrations import init_db
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
    # feen nekteba de8re app.run(debug=True) bas hek sar feena kamen nshoofo 3al telephone kif shaklo
 
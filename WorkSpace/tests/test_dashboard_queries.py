@@ -0,0 +1,84 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from Website import create_app, db
+from Website.migrations import init_db
+from Website.models import User, Course, Enrollment, Grade, Attendance, CourseInstructor
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    monkeypatch.setenv("SECRET_KEY", "test")
+    monkeypatch.setenv("MAIL_FROM", "noreply@example.com")
+    monkeypatch.setenv("METRICS_ENABLED", "false")
+    monkeypatch.setenv("SLOW_QUERY_MS", "0")
+    monkeypatch.setenv("SLOW_QUERY_SCANS", "false")
+
+    def make(name):
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / name}.db")
+        app = create_app()
+        app.config["TESTING"] = True
+        with app.app_context():
+            init_db()
+        return app
+    return make
+
+
+def seed(app, courses):
+    with app.app_context():
+        instructor = User(first_name="Ada", last_name="Teach", email="teacher@example.com", password="x",
+                          role="instructor", choose_role=True, email_verified=True)
+        student = User(first_name="Sam", last_name="Study", email="student@example.com", password="x",
+                       role="student", choose_role=True, email_verified=True)
+        db.session.add_all([instructor, student])
+        db.session.flush()
+        for i in range(courses):
+            course = Course(course_name=f"Course {i}", course_code=f"C{i}")
+            db.session.add(course)
+            db.session.flush()
+            db.session.add(CourseInstructor(course_id=course.id, instructor_id=instructor.id))
+            enrollment = Enrollment(user_id=student.id, course_id=course.id)
+            db.session.add(enrollment)
+            db.session.flush()
+            for n, status in enumerate(("present", "absent", "present")):
+                db.session.add(Attendance(enrollment_id=enrollment.id, date=date(2026, 10, n + 1), status=status))
+                enrollment.apply_attendance(status)
+            db.session.add(Grade(enrollment_id=enrollment.id, exam_name="Midterm", score=70 + i, weight=1.0))
+            enrollment.apply_grade(70 + i, 1.0)
+            enrollment.refresh_risk()
+        db.session.commit()
+        return student.id
+
+
+def count_queries(app, student_id, path):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["_user_id"] = str(student_id)
+        s["_fresh"] = True
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize("path", ["/student-dashboard", "/run-scan"])
+def test_query_count_does_not_grow_with_courses(make_app, path):
+    one = make_app("one")
+    many = make_app("many")
+    one_student = seed(one, 1)
+    many_student = seed(many, 12)
+
+    assert count_queries(many, many_student, path) == count_queries(one, one_student, path)